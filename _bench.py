@@ -0,0 +1,51 @@
+import math
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def median_confidence_interval(values, z=1.96):
+    """Distribution-free confidence interval of the median (95% by default).
+
+    Bounds are order statistics chosen with the normal approximation
+    of the binomial distribution.
+    """
+    values = sorted(values)
+    n = len(values)
+    if n < 3:
+        return values[0], values[-1]
+    lower = int(math.floor(n / 2.0 - z * math.sqrt(n) / 2.0))
+    upper = int(math.ceil(1 + n / 2.0 + z * math.sqrt(n) / 2.0))
+    return values[max(0, lower - 1)], values[min(n - 1, upper - 1)]
+
+
+def mann_whitney(first, second):
+    """Two-sided p-value of Mann-Whitney U test, normal approximation with tie correction."""
+    ranked = sorted([(value, 0) for value in first] + [(value, 1) for value in second])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    index = 0
+    while index < len(ranked):
+        end = index
+        while end + 1 < len(ranked) and ranked[end + 1][0] == ranked[index][0]:
+            end += 1
+        for position in range(index, end + 1):
+            ranks[position] = (index + end) / 2.0 + 1
+        count = end - index + 1
+        ties += count ** 3 - count
+        index = end + 1
+
+    n1, n2 = len(first), len(second)
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    variance = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = abs(u - n1 * n2 / 2.0) / math.sqrt(variance)
+    return math.erfc(z / math.sqrt(2))
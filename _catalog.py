@@ -0,0 +1,169 @@
+import os
+
+from _init import *
+
+CATALOG_PATH = os.path.join(CONFIG_DIR, 'tasks.json')
+# plain list of task names for shell completion, read without starting python
+TASK_NAMES_PATH = os.path.join(CONFIG_DIR, 'task-names')
+# directories whose mtime tells completion scripts that task-names is stale
+TASK_DIRS_PATH = os.path.join(CONFIG_DIR, 'task-dirs')
+
+_catalog = None
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_git_dirs(repo_path):
+    """Return git directory of repo_path and the directory with shared refs."""
+    git_dir = os.path.join(repo_path, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            with open(git_dir) as git_file:
+                git_dir = os.path.join(repo_path, git_file.read().strip()[len('gitdir: '):])
+        with open(os.path.join(git_dir, 'commondir')) as commondir:
+            return git_dir, os.path.join(git_dir, commondir.read().strip())
+    except OSError:
+        return git_dir, git_dir
+
+
+def read_ref(git_dir, ref):
+    try:
+        with open(os.path.join(git_dir, ref)) as ref_file:
+            return ref_file.read().strip()
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(git_dir, 'packed-refs')) as packed_refs:
+            for line in packed_refs:
+                sha, _, name = line.strip().partition(' ')
+                if name == ref:
+                    return sha
+    except OSError:
+        pass
+    return None
+
+
+def read_head(repo_path):
+    """Return commit checked out in repo_path without spawning git."""
+    git_dir, common_dir = get_git_dirs(repo_path)
+    head = read_ref(git_dir, 'HEAD')
+    if head is not None and head.startswith('ref: '):
+        return read_ref(common_dir, head[len('ref: '):])
+    return head
+
+
+def list_branches(repo_path):
+    _, common_dir = get_git_dirs(repo_path)
+    heads_dir = os.path.join(common_dir, 'refs', 'heads')
+    branches = set()
+    for directory, _, files in os.walk(heads_dir):
+        for name in files:
+            branches.add(os.path.relpath(os.path.join(directory, name), heads_dir))
+    try:
+        with open(os.path.join(common_dir, 'packed-refs')) as packed_refs:
+            for line in packed_refs:
+                _, _, name = line.strip().partition(' ')
+                if name.startswith('refs/heads/'):
+                    branches.add(name[len('refs/heads/'):])
+    except OSError:
+        pass
+    branches.discard('master')
+    return branches
+
+
+def list_task_dirs():
+    tasks_dir = os.path.join(TPCC_REPO, 'tasks')
+    try:
+        groups = sorted(entry for entry in os.listdir(tasks_dir) if not entry.startswith('.'))
+    except OSError:
+        return []
+    dirs = [tasks_dir]
+    for group in groups:
+        group_dir = os.path.join(tasks_dir, group)
+        if not os.path.isdir(group_dir):
+            continue
+        dirs.append(group_dir)
+        dirs.extend(os.path.join(group_dir, task) for task in sorted(os.listdir(group_dir))
+                    if not task.startswith('.') and os.path.isdir(os.path.join(group_dir, task)))
+    return dirs
+
+
+def fingerprint():
+    """Everything the catalog depends on.
+
+    Adding or removing a task or its CMakeLists.txt changes the mtime of
+    its parent directory, creating a branch changes the refs directories.
+    """
+    _, common_dir = get_git_dirs(SOLUTIONS_REPO)
+    refs = [os.path.join(common_dir, 'packed-refs')]
+    refs.extend(directory for directory, _, _ in os.walk(os.path.join(common_dir, 'refs', 'heads')))
+    return {
+        'head': read_head(TPCC_REPO),
+        'mtimes': {path: get_mtime(path) for path in list_task_dirs() + refs}
+    }
+
+
+def template_name(task_dir):
+    name = '{}.hpp'.format(os.path.basename(task_dir).replace('-', '_'))
+    return name if os.path.exists(os.path.join(task_dir, name)) else None
+
+
+def scan():
+    tasks_dir = os.path.join(TPCC_REPO, 'tasks')
+    branches = list_branches(SOLUTIONS_REPO)
+    tasks = {}
+    for task_dir in list_task_dirs():
+        task = os.path.relpath(task_dir, tasks_dir).replace(os.sep, '/')
+        if task.count('/') != 1:
+            continue
+        practical = os.path.exists(os.path.join(task_dir, 'CMakeLists.txt'))
+        tasks[task] = {
+            'practical': practical,
+            'template': template_name(task_dir) if practical else None,
+            'branch': task in branches
+        }
+    return {'tasks': tasks, 'fingerprint': fingerprint()}
+
+
+def get_catalog(refresh=False):
+    """Return catalog of course tasks, rescanning tasks/ only if something changed."""
+    global _catalog
+    if _catalog is not None and not refresh:
+        return _catalog
+
+    if not refresh:
+        try:
+            with open(CATALOG_PATH) as cached:
+                catalog = json.load(cached)
+            if catalog.get('fingerprint') == fingerprint():
+                _catalog = catalog
+                catalog_mtime = get_mtime(CATALOG_PATH)
+                if any(get_mtime(path) is None or get_mtime(path) < catalog_mtime
+                       for path in (TASK_NAMES_PATH, TASK_DIRS_PATH)):
+                    write_completion_index(_catalog)
+                return _catalog
+        except (OSError, ValueError):
+            pass
+
+    logger.info('Scanning course tasks')
+    _catalog = scan()
+    write_atomic(CATALOG_PATH, json.dumps(_catalog, indent=4))
+    write_completion_index(_catalog)
+    return _catalog
+
+
+def write_completion_index(catalog):
+    write_atomic(TASK_NAMES_PATH, ''.join(task + '\n' for task in sorted(catalog['tasks'])))
+    # task names change only when tasks/ or a group directory changes
+    group_dirs = [path for path in list_task_dirs()
+                  if os.path.relpath(path, os.path.join(TPCC_REPO, 'tasks')).count(os.sep) == 0]
+    write_atomic(TASK_DIRS_PATH, ''.join(path + '\n' for path in group_dirs))
+
+
+def get_task_info(task):
+    return get_catalog()['tasks'].get(task)
@@ -0,0 +1,174 @@
+"""Resident tpcc server.
+
+The server keeps heavy third-party modules imported and forks a child for
+every request. The child takes over stdin, stdout and stderr of the client
+(passed over the Unix socket), imports tpcc afresh, so that configuration
+and state are always current, and runs the command.
+"""
+
+import array
+import atexit
+import importlib
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.tpcc', 'tpccd.sock')
+PID_PATH = os.path.join(os.path.expanduser('~'), '.tpcc', 'tpccd.pid')
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that are slow to import but do not depend on configuration
+PRELOAD = ['argparse', 'concurrent.futures', 'hashlib', 'logging', 'subprocess', 'tarfile', 'git', 'gitlab']
+
+HEADER = struct.Struct('!I')
+# pid, uid and gid of the connected process
+PEERCRED = struct.Struct('3i')
+
+
+def send_request(sock, request, fds):
+    data = json.dumps(request).encode()
+    sock.sendmsg([HEADER.pack(len(data)) + data],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def receive_request(sock):
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(64 * 1024, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+    while len(data) < HEADER.size or len(data) < HEADER.size + HEADER.unpack_from(data)[0]:
+        chunk = sock.recv(64 * 1024)
+        if not chunk:
+            raise EOFError('Truncated request')
+        data += chunk
+    length = HEADER.unpack_from(data)[0]
+    return json.loads(data[HEADER.size:HEADER.size + length].decode()), list(fds)
+
+
+def send_reply(conn, reply):
+    conn.sendall((json.dumps(reply) + '\n').encode())
+
+
+def run_command(argv):
+    # configuration and state are read on import, so import tpcc modules afresh
+    for name, module in list(sys.modules.items()):
+        if name == '__main__':
+            # the daemon itself
+            continue
+        if os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '/')) == SOURCE_DIR:
+            del sys.modules[name]
+    sys.argv = ['tpcc'] + argv
+    try:
+        importlib.import_module('tpcc').main()
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle(conn, request, fds):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # whatever the daemon buffered for /dev/null must not reach the client
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for fd, target in zip(fds, (0, 1, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+    # buffer like an interpreter started on the client's terminal would,
+    # the daemon's own streams are block buffered for /dev/null
+    sys.stdin = open(0, 'r', closefd=False)
+    sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, closefd=False)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    send_reply(conn, {'pid': os.getpid()})
+    exit_code = run_command(request['argv'])
+    # the child leaves with os._exit, run what normal interpreter exit would
+    atexit._run_exitfuncs()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    send_reply(conn, {'exit': exit_code})
+
+
+def peer_uid(conn):
+    _, uid, _ = PEERCRED.unpack(conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size))
+    return uid
+
+
+def serve():
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # requests run with the environment the client sends, the socket must
+    # never be reachable by other users, not even until a chmod
+    umask = os.umask(0o077)
+    try:
+        server.bind(SOCKET_PATH)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    with open(PID_PATH, 'w') as pid_file:
+        pid_file.write(str(os.getpid()))
+
+    # finished children are reaped by the kernel
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            conn, _ = server.accept()
+            if peer_uid(conn) != os.getuid():
+                conn.close()
+                continue
+            try:
+                request, fds = receive_request(conn)
+            except (OSError, ValueError, EOFError):
+                conn.close()
+                continue
+            if request.get('control') == 'stop':
+                send_reply(conn, {'pid': os.getpid()})
+                conn.close()
+                break
+            if request.get('control') == 'ping':
+                send_reply(conn, {'pid': os.getpid()})
+                conn.close()
+                continue
+            if os.fork() == 0:
+                server.close()
+                try:
+                    handle(conn, request, fds)
+                finally:
+                    os._exit(0)
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(SOCKET_PATH)
+        os.unlink(PID_PATH)
+
+
+if __name__ == '__main__':
+    serve()
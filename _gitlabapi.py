@@ -0,0 +1,92 @@
+import threading
+import time
+
+from _init import *
+from _timing import timed
+
+GITLAB_CACHE_PATH = os.path.join(CONFIG_DIR, 'gitlab-cache.json')
+DEFAULT_GITLAB_URL = 'https://gitlab.com'
+# project and user ids practically never change
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+
+_client = None
+_cache_lock = threading.Lock()
+
+
+def get_gitlab():
+    """Return GitLab client shared by all calls of this process.
+
+    The client keeps one HTTP session, so the connection is reused.
+    """
+    global _client
+    if _client is None:
+        import gitlab
+        _client = gitlab.Gitlab(config.get('gitlab_url', DEFAULT_GITLAB_URL), private_token=config['gitlab_token'])
+    return _client
+
+
+def load_cache():
+    try:
+        with open(GITLAB_CACHE_PATH) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def cache_key(kind, name):
+    # the same names may mean different objects on another GitLab instance
+    return '{} {} {}'.format(config.get('gitlab_url', DEFAULT_GITLAB_URL), kind, name)
+
+
+def cached_lookup(kind, name, fetch):
+    key = cache_key(kind, name)
+    ttl = config.get('gitlab_cache_ttl', DEFAULT_CACHE_TTL)
+    with _cache_lock:
+        entry = load_cache().get(key)
+    if entry is not None and time.time() - entry['time'] < ttl:
+        return entry['value']
+
+    value = fetch()
+    with _cache_lock:
+        cache = load_cache()
+        cache[key] = {'value': value, 'time': time.time()}
+        write_atomic(GITLAB_CACHE_PATH, json.dumps(cache))
+    return value
+
+
+def invalidate(kind, name):
+    with _cache_lock:
+        cache = load_cache()
+        cache.pop(cache_key(kind, name), None)
+        write_atomic(GITLAB_CACHE_PATH, json.dumps(cache))
+
+
+def get_project_id(project_path):
+    def fetch():
+        with timed('gitlab projects.get'):
+            return get_gitlab().projects.get(project_path).id
+    return cached_lookup('project', project_path, fetch)
+
+
+def get_user_id(username):
+    def fetch():
+        with timed('gitlab users.list'):
+            users = get_gitlab().users.list(username=username)
+        if not users:
+            raise ValueError('GitLab user {} not found'.format(username))
+        return users[0].id
+    return cached_lookup('user', username, fetch)
+
+
+def resolve(project_path, username):
+    """Look up project and user ids at once, both are usually cached."""
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        project = executor.submit(get_project_id, project_path)
+        user = executor.submit(get_user_id, username)
+        return project.result(), user.result()
+
+
+def get_project(project_id):
+    # lazy object: no request until something is done with the project
+    return get_gitlab().projects.get(project_id, lazy=True)
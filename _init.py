@@ -1,5 +1,7 @@
 import os
 import sys
+import copy
+import fcntl
 import logging
 from pathlib import Path
 import json
@@ -9,24 +11,27 @@ from _subprwrapper import run
 
 
 def exit(exit_code):
-    json.dump(state, open(STATE_PATH, 'w'))
+    save_state()
     sys.exit(exit_code)
 
 
 CONFIG_DIR = os.path.join(str(Path.home()), '.tpcc')
 CONFIG_PATH = os.path.join(CONFIG_DIR, 'config.json')
 STATE_PATH = os.path.join(CONFIG_DIR, 'state.json')
+STATE_LOCK_PATH = os.path.join(CONFIG_DIR, 'state.lock')
 
 DEVNULL = open(os.devnull, 'wb')
 DEFAULT_OUTPUT = None
 DEFAULT_ERROR  = DEVNULL
+BUILD_JOBS = None
 
 logger = logging.getLogger('tpcc')
 
-log_file_handler = logging.FileHandler(os.path.join(CONFIG_DIR, 'tpcc.log'))
+# delay opening log files until something is actually logged
+log_file_handler = logging.FileHandler(os.path.join(CONFIG_DIR, 'tpcc.log'), delay=True)
 log_file_handler.setLevel(logging.INFO)
 
-debug_log_file_handler = logging.FileHandler(os.path.join(CONFIG_DIR, 'tpcc-debug.log'))
+debug_log_file_handler = logging.FileHandler(os.path.join(CONFIG_DIR, 'tpcc-debug.log'), delay=True)
 debug_log_file_handler.setLevel(logging.DEBUG)
 
 stream_handler = logging.StreamHandler()
@@ -53,6 +58,8 @@ except Exception as e:
 try:
     repos_path = os.path.expandvars(os.path.expanduser(config['path_to_repos']))
     SOLUTIONS_REPO = os.path.join(repos_path, 'solutions')
+    WORKTREES_DIR = os.path.join(repos_path, 'solutions-worktrees')
+    MAIN_WORKTREE = os.path.join(WORKTREES_DIR, '.main')
     TPCC_REPO = os.path.join(repos_path, config['course_repo_name'])
 except KeyError as e:
     logger.error('Key "{}" is missing in configuration file'.format(e.args[0]))
@@ -62,16 +69,64 @@ except Exception as e:
     traceback.print_exc()
     sys.exit(1)
 
+def write_atomic(path, data):
+    """Replace file contents so that readers see either old or new data."""
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as temp:
+            temp.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def merge_state_field(current, loaded, value):
+    if isinstance(value, list) and isinstance(current, list) and isinstance(loaded, list):
+        # keep items other processes added or removed meanwhile
+        added = [item for item in value if item not in loaded]
+        removed = [item for item in loaded if item not in value]
+        return [item for item in current if item not in removed] + \
+               [item for item in added if item not in current]
+    return value
+
+
+def save_state():
+    """Write fields changed by this process to the state file.
+
+    The file is re-read under an exclusive lock and replaced atomically, so
+    concurrent tpcc processes do not lose each other's changes.
+    """
+    global loaded_state
+    changed = {field: value for field, value in state.items() if loaded_state.get(field) != value}
+    if not changed:
+        return
+    with open(STATE_LOCK_PATH, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(STATE_PATH) as json_state:
+                current = json.load(json_state)
+        except (OSError, ValueError):
+            current = {}
+        for field, value in changed.items():
+            current[field] = merge_state_field(current.get(field), loaded_state.get(field), value)
+        write_atomic(STATE_PATH, json.dumps(current))
+    state.update(current)
+    loaded_state = copy.deepcopy(state)
+
+
 try:
     with open(STATE_PATH) as json_state:
         state = json.load(json_state)
+    loaded_state = copy.deepcopy(state)
 except FileNotFoundError:
     state = {
         'task': '',
         'merged_tasks': []
     }
-    with open(STATE_PATH, 'w') as json_state:
-        json.dump(state, json_state)
+    loaded_state = {}
+    save_state()
 except ValueError:
     logger.error('Malformed state file: JSON format expected')
     sys.exit(1)
@@ -101,7 +156,55 @@ def get_merged_tasks():
     return get_list_state_field('merged_tasks')
 
 
+def get_head_branch(repo_path):
+    """Return the branch checked out in repo_path without spawning git.
+
+    None is returned for a detached HEAD or if HEAD can not be read.
+    """
+    git_dir = os.path.join(repo_path, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            # worktrees and submodules have a .git file pointing to the real git directory
+            with open(git_dir) as git_file:
+                git_dir = os.path.join(repo_path, git_file.read().strip()[len('gitdir: '):])
+        with open(os.path.join(git_dir, 'HEAD')) as head:
+            ref = head.read().strip()
+    except OSError:
+        return None
+    if ref.startswith('ref: refs/heads/'):
+        return ref[len('ref: refs/heads/'):]
+    return None
+
+
+def worktree_mode():
+    return config.get('worktrees', False)
+
+
+def get_task_worktree(task_name):
+    return os.path.join(WORKTREES_DIR, task_name)
+
+
+def activate_worktree(worktree):
+    """Point SOLUTIONS_REPO symlink to worktree.
+
+    The symlink is replaced atomically, so nothing in the worktrees
+    is touched and their build state stays intact.
+    """
+    link = SOLUTIONS_REPO + '.tpcc-tmp'
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.symlink(worktree, link)
+    os.replace(link, SOLUTIONS_REPO)
+
+
 def checkout_to_current_task():
+    if current_task() != '' and get_head_branch(SOLUTIONS_REPO) == current_task():
+        return
+
+    if worktree_mode() and os.path.isdir(get_task_worktree(current_task())):
+        activate_worktree(get_task_worktree(current_task()))
+        return
+
     checkout = run(['git', 'checkout', current_task()],
                    cwd=SOLUTIONS_REPO,
                    stdout=DEFAULT_OUTPUT,
@@ -0,0 +1,174 @@
+"""Persistent queue of branches to push.
+
+Commands only record the branch in the queue and make sure a worker is
+running. The worker is a detached process that pushes queued branches,
+retrying failed pushes with exponential backoff, and exits when nothing
+is left to do. A branch is queued at most once: whatever its head is when
+the push starts gets pushed.
+"""
+
+import contextlib
+import fcntl
+import subprocess
+import sys
+import time
+
+from _init import *
+
+PUSH_QUEUE_PATH = os.path.join(CONFIG_DIR, 'push-queue.json')
+PUSH_QUEUE_LOCK_PATH = os.path.join(CONFIG_DIR, 'push-queue.lock')
+PUSH_WORKER_LOCK_PATH = os.path.join(CONFIG_DIR, 'push-worker.lock')
+
+
+def async_push_enabled():
+    return config.get('async_push', False)
+
+
+@contextlib.contextmanager
+def locked_queue():
+    """Yield queue for modification, it is saved when the block exits."""
+    with open(PUSH_QUEUE_LOCK_PATH, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        queue = load_queue()
+        yield queue
+        write_atomic(PUSH_QUEUE_PATH, json.dumps(queue, indent=4))
+
+
+def load_queue():
+    try:
+        with open(PUSH_QUEUE_PATH) as queue_file:
+            return json.load(queue_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def enqueue(branch, repo=SOLUTIONS_REPO):
+    with locked_queue() as queue:
+        entry = queue.setdefault(branch, {'repo': repo, 'generation': 0})
+        # a newer commit supersedes earlier failures
+        entry.update({
+            'generation': entry['generation'] + 1,
+            'queued': time.time(),
+            'attempts': 0,
+            'next_attempt': 0,
+            'failed': False
+        })
+    start_worker()
+
+
+def retry_failed():
+    with locked_queue() as queue:
+        for entry in queue.values():
+            entry.update({'attempts': 0, 'next_attempt': 0, 'failed': False})
+    if queue:
+        start_worker()
+
+
+def worker_running():
+    with open(PUSH_WORKER_LOCK_PATH, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+    return False
+
+
+def start_worker():
+    if worker_running():
+        return
+    subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def retry_delay(attempts):
+    delay = config.get('push_retry_delay', 5)
+    return min(delay * 2 ** (attempts - 1), config.get('push_retry_max_delay', 300))
+
+
+def push(branch, repo):
+    env = dict(os.environ)
+    # nobody is there to type a password
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    result = run(['git', 'push', '--set-upstream', 'origin', branch],
+                 cwd=repo,
+                 env=env,
+                 stdout=subprocess.PIPE,
+                 stderr=subprocess.STDOUT,
+                 universal_newlines=True,
+                 timeout=config.get('push_timeout', 120))
+    if result.timed_out:
+        return 'timed out'
+    if result.returncode != 0:
+        errors = [line for line in result.stdout.splitlines() if line.startswith(('fatal:', 'error:'))]
+        return errors[0] if errors else 'exit code {}'.format(result.returncode)
+    return None
+
+
+def next_push(queue):
+    """Return the branch due for push and seconds to wait for the next one."""
+    now = time.time()
+    pending = [(entry['next_attempt'], branch) for branch, entry in queue.items() if not entry['failed']]
+    if not pending:
+        return None, None
+    next_attempt, branch = min(pending)
+    if next_attempt <= now:
+        return branch, 0
+    return None, next_attempt - now
+
+
+def work():
+    worker_lock = open(PUSH_WORKER_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(worker_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return
+
+    max_attempts = config.get('push_max_attempts', 8)
+    while True:
+        with locked_queue() as queue:
+            branch, wait = next_push(queue)
+            if branch is None and wait is None:
+                # release while holding the queue lock: whoever queues a push
+                # after this point finds no worker and starts a new one
+                worker_lock.close()
+                return
+            if branch is not None:
+                entry = dict(queue[branch])
+        if branch is None:
+            # new pushes are queued with next_attempt 0, do not oversleep them
+            time.sleep(min(wait, 1))
+            continue
+
+        error = push(branch, entry['repo'])
+        with locked_queue() as queue:
+            current = queue.get(branch)
+            if current is None or current['generation'] != entry['generation']:
+                # queued again while pushing, the new commit may have been missed
+                continue
+            if error is None:
+                del queue[branch]
+                logger.info('Pushed {}'.format(branch))
+                continue
+            current['attempts'] += 1
+            current['last_error'] = error
+            current['next_attempt'] = time.time() + retry_delay(current['attempts'])
+            current['failed'] = current['attempts'] >= max_attempts
+            logger.warning('Push of {} failed ({}), attempt {}'.format(branch, error, current['attempts']))
+
+
+def describe_entry(branch, entry):
+    if entry['failed']:
+        status = 'failed after {} attempts: {}'.format(entry['attempts'], entry.get('last_error'))
+    elif entry['attempts']:
+        status = 'retry in {:.0f}s, {} failed attempts: {}'.format(
+            max(0.0, entry['next_attempt'] - time.time()), entry['attempts'], entry.get('last_error'))
+    else:
+        status = 'pending'
+    return '{}: {}'.format(branch, status)
+
+
+if __name__ == '__main__':
+    work()
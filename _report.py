@@ -0,0 +1,252 @@
+import re
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+from _init import *
+
+REPORTS_DIR = os.path.join(CONFIG_DIR, 'reports')
+
+# number of previous runs a test duration is compared with
+HISTORY_WINDOW = 10
+# slowdowns shorter than this are noise
+MIN_REGRESSION = 0.1
+
+GTEST_RUN = re.compile(r'^\[ RUN +\] (\S+)')
+GTEST_DONE = re.compile(r'^\[ +(OK|FAILED|SKIPPED) +\] (\S+)(?: \((\d+) ms\))?')
+SANITIZER_START = re.compile(r'^(?:==\d+==ERROR|WARNING): (\w+Sanitizer): (.+?)(?: on (?:unknown )?address.*| \(pid=\d+\))?$')
+STACK_FRAME = re.compile(r'^\s+#\d+ (?:0x[0-9a-f]+ )?(?:in )?(.*?) ?((?:/|\.)\S*:\d+(?::\d+)?)')
+STACK_FRAME_NO_SOURCE = re.compile(r'^\s+#\d+ (?:0x[0-9a-f]+ )?(?:in )?(.*)$')
+SANITIZER_SUMMARY = re.compile(r'^SUMMARY: (\w+Sanitizer): (\S+) (.*)$')
+
+GTEST_STATUS = {'OK': 'passed', 'FAILED': 'failed', 'SKIPPED': 'skipped'}
+
+# keep failure output of a single test reasonably small
+MAX_TEST_OUTPUT = 200
+
+_history_lock = threading.Lock()
+
+
+def gtest_name(line):
+    """Return name of the test a Google Test progress line is about."""
+    match = GTEST_RUN.match(line)
+    if match:
+        return match.group(1)
+    match = GTEST_DONE.match(line)
+    return match.group(2) if match else None
+
+
+class TestOutputParser:
+    """Turn test output into per-test records as it streams.
+
+    Google Test progress lines give test names, statuses and durations.
+    Sanitizer reports are split into type, stack and location and attached
+    to the test that was running when they were printed.
+    """
+
+    def __init__(self, flavor):
+        self.flavor = flavor
+        self.records = []
+        self.sanitizer_reports = []
+        self.current = None
+        self.sanitizer = None
+
+    def feed(self, line):
+        line = line.rstrip('\n')
+        if self.current is not None and len(self.current['output']) < MAX_TEST_OUTPUT:
+            self.current['output'].append(line)
+
+        match = GTEST_RUN.match(line)
+        if match:
+            self.current = self.new_record(match.group(1))
+            return
+        match = GTEST_DONE.match(line)
+        if match and self.current is not None and match.group(2) == self.current['name']:
+            self.current['status'] = GTEST_STATUS[match.group(1)]
+            if match.group(3) is not None:
+                self.current['duration'] = int(match.group(3)) / 1000.0
+            self.current = None
+            return
+
+        match = SANITIZER_START.match(line)
+        if match:
+            self.sanitizer = {
+                'tool': match.group(1),
+                'type': match.group(2),
+                'location': None,
+                'stack': [],
+                'test': self.current['name'] if self.current is not None else None
+            }
+            self.sanitizer_reports.append(self.sanitizer)
+            if self.current is not None:
+                self.current['sanitizer'].append(self.sanitizer)
+            return
+        if self.sanitizer is None:
+            return
+        match = STACK_FRAME.match(line)
+        if match:
+            self.sanitizer['stack'].append({'function': match.group(1) or None, 'location': match.group(2)})
+            if self.sanitizer['location'] is None:
+                self.sanitizer['location'] = match.group(2)
+            return
+        match = STACK_FRAME_NO_SOURCE.match(line)
+        if match:
+            self.sanitizer['stack'].append({'function': match.group(1), 'location': None})
+            return
+        match = SANITIZER_SUMMARY.match(line)
+        if match:
+            self.sanitizer['type'] = match.group(2)
+            self.sanitizer['location'] = match.group(3).split(' in ')[0]
+            self.sanitizer = None
+
+    def new_record(self, name):
+        record = {'name': name, 'flavor': self.flavor, 'status': 'crashed', 'duration': None,
+                  'sanitizer': [], 'output': []}
+        self.records.append(record)
+        return record
+
+    def add_record(self, name, returncode, duration, output, resources=None):
+        """Add a test that was run on its own, e.g. by sharding."""
+        record = self.new_record(name)
+        record['duration'] = duration
+        record['resources'] = resources
+        self.current = record
+        for line in output.splitlines():
+            test = gtest_name(line)
+            if test is not None and (name == test or name.endswith(':' + test)):
+                # progress lines of the test itself, not a nested test
+                if len(record['output']) < MAX_TEST_OUTPUT:
+                    record['output'].append(line)
+                continue
+            self.feed(line)
+        self.current = None
+        self.sanitizer = None
+        record['status'] = 'passed' if returncode == 0 and not record['sanitizer'] else 'failed'
+        return record
+
+    def finish(self, returncode, duration=None):
+        """Complete parsing; output without recognizable tests is one test named after the flavor.
+
+        duration is the measured time of the whole run, given to that test.
+        """
+        if not self.records:
+            record = self.new_record(self.flavor)
+            record['sanitizer'] = list(self.sanitizer_reports)
+            record['status'] = 'passed' if returncode == 0 else 'failed'
+            record['duration'] = duration
+            # the run target builds the tests too, its time says nothing about the solution
+            record['whole_run'] = True
+        for record in self.records:
+            if record['sanitizer'] and record['status'] == 'passed':
+                record['status'] = 'failed'
+        return self.records
+
+
+def report_paths(task, flavor, report_dir=None):
+    directory = os.path.join(report_dir or REPORTS_DIR, task)
+    return os.path.join(directory, flavor + '.json'), os.path.join(directory, flavor + '.xml')
+
+
+def write_json_report(path, task, flavor, records, resources=None):
+    with open(path, 'w') as report:
+        json.dump({
+            'task': task,
+            'flavor': flavor,
+            'time': time.time(),
+            'resources': resources,
+            'tests': records,
+        }, report, indent=4)
+
+
+def write_junit_report(path, task, flavor, records):
+    failures = [record for record in records if record['status'] in ('failed', 'crashed')]
+    suite = ElementTree.Element('testsuite', {
+        'name': '{}.{}'.format(task, flavor),
+        'tests': str(len(records)),
+        'failures': str(len(failures)),
+        'skipped': str(sum(record['status'] == 'skipped' for record in records)),
+        'time': '{:.3f}'.format(sum(record['duration'] or 0 for record in records))
+    })
+    for record in records:
+        case = ElementTree.SubElement(suite, 'testcase', {
+            'classname': '{}.{}'.format(task, flavor),
+            'name': record['name'],
+            'time': '{:.3f}'.format(record['duration'] or 0)
+        })
+        if record['status'] == 'skipped':
+            ElementTree.SubElement(case, 'skipped')
+        elif record['status'] in ('failed', 'crashed'):
+            message = ', '.join('{}: {} at {}'.format(report['tool'], report['type'], report['location'])
+                                for report in record['sanitizer']) or record['status']
+            failure = ElementTree.SubElement(case, 'failure', {'message': message})
+            failure.text = '\n'.join(record['output'])
+    ElementTree.ElementTree(suite).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def history_path(task):
+    return os.path.join(REPORTS_DIR, task, 'history.jsonl')
+
+
+def load_history(task):
+    history = {}
+    try:
+        with open(history_path(task)) as history_file:
+            for line in history_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('duration') is not None and entry.get('status') == 'passed':
+                    history.setdefault((entry['flavor'], entry['name']), []).append(entry['duration'])
+    except OSError:
+        pass
+    return history
+
+
+def find_regressions(task, records, threshold):
+    """Return (record, median of previous durations) of tests that got slower."""
+    history = load_history(task)
+    regressions = []
+    for record in records:
+        if record.get('whole_run'):
+            continue
+        previous = history.get((record['flavor'], record['name']), [])[-HISTORY_WINDOW:]
+        if record['status'] != 'passed' or record['duration'] is None or len(previous) < 3:
+            continue
+        median = sorted(previous)[len(previous) // 2]
+        if record['duration'] > median * threshold and record['duration'] - median > MIN_REGRESSION:
+            regressions.append((record, median))
+    return regressions
+
+
+def append_history(task, records):
+    path = history_path(task)
+    now = time.time()
+    with _history_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as history_file:
+            for record in records:
+                if record.get('whole_run'):
+                    continue
+                history_file.write(json.dumps({
+                    'time': now,
+                    'flavor': record['flavor'],
+                    'name': record['name'],
+                    'status': record['status'],
+                    'duration': record['duration']
+                }) + '\n')
+
+
+def save_report(task, flavor, records, report_dir=None, resources=None):
+    """Write JSON and JUnit reports, update history and return duration regressions.
+
+    resources is the usage of the test run: wall and CPU time, peak RSS,
+    context switches and whether it timed out.
+    """
+    json_path, junit_path = report_paths(task, flavor, report_dir)
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    write_json_report(json_path, task, flavor, records, resources)
+    write_junit_report(junit_path, task, flavor, records)
+    regressions = find_regressions(task, records, config.get('duration_regression_threshold', 1.5))
+    append_history(task, records)
+    return regressions
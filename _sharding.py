@@ -0,0 +1,143 @@
+import subprocess
+import time
+
+from _init import *
+
+DURATIONS_DIR = os.path.join(CONFIG_DIR, 'durations')
+
+GTEST_LIST = ['--gtest_list_tests']
+GTEST_FILTER = '--gtest_filter={}'
+
+
+class TestCase:
+    def __init__(self, binary, name, command):
+        self.binary = binary
+        self.name = name
+        self.command = command
+
+    @property
+    def key(self):
+        return '{}:{}'.format(os.path.basename(self.binary), self.name)
+
+
+def find_test_binaries(build_path, keyword):
+    binaries = []
+    for directory, dirs, files in os.walk(build_path):
+        dirs[:] = [name for name in dirs if name != 'CMakeFiles']
+        for name in files:
+            path = os.path.join(directory, name)
+            if keyword in name and os.path.isfile(path) and os.access(path, os.X_OK):
+                binaries.append(path)
+    return sorted(binaries)
+
+
+def parse_gtest_list(output):
+    """Return test names from --gtest_list_tests output, None if it is not one.
+
+    A binary that is not a Google Test one ignores the flag and runs its
+    tests instead, so anything but suite lines followed by indented test
+    names is rejected.
+    """
+    names = []
+    suite = None
+    for line in output.splitlines():
+        if not line.strip() or line.startswith('Running main()'):
+            continue
+        entry = line.split('#')[0].strip()
+        if not line.startswith(' '):
+            if not entry.endswith('.') or ' ' in entry:
+                return None
+            suite = entry
+        elif suite is None or not entry or ' ' in entry:
+            return None
+        else:
+            names.append(suite + entry)
+    return names or None
+
+
+def list_test_cases(binary):
+    """List test cases of binary, each runnable as a separate process.
+
+    Google Test binaries are detected automatically, other frameworks are
+    described by test_list_args and test_run_args configuration keys.
+    A binary that can not list its tests is a single test case.
+    """
+    listing = run([binary] + GTEST_LIST, cwd=os.path.dirname(binary),
+                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    names = parse_gtest_list(listing.stdout) if listing.returncode == 0 else None
+    if names is not None:
+        return [TestCase(binary, name, [binary, GTEST_FILTER.format(name)]) for name in names]
+
+    list_args = config.get('test_list_args')
+    run_args = config.get('test_run_args')
+    if list_args and run_args:
+        listing = run([binary] + list_args, cwd=os.path.dirname(binary),
+                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if listing.returncode == 0 and listing.stdout.split():
+            return [TestCase(binary, name, [binary] + [arg.format(name) for arg in run_args])
+                    for name in listing.stdout.split()]
+
+    return [TestCase(binary, os.path.basename(binary), [binary])]
+
+
+def durations_path(task, flavor):
+    return os.path.join(DURATIONS_DIR, task, flavor + '.json')
+
+
+def load_durations(task, flavor):
+    try:
+        with open(durations_path(task, flavor)) as durations:
+            return json.load(durations)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_durations(task, flavor, durations):
+    path = durations_path(task, flavor)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, json.dumps(durations))
+
+
+def schedule(cases, durations):
+    """Order cases longest first, cases never run before go first of all."""
+    return sorted(cases, key=lambda case: -durations.get(case.key, float('inf')))
+
+
+def run_test_case(case, env=None, timeout=None, limits=None):
+    start = time.time()
+    testing = run(case.command, cwd=os.path.dirname(case.binary), env=env, timeout=timeout, limits=limits,
+                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    output = testing.stdout
+    if testing.timed_out:
+        output += '\ntimed out after {}s\n'.format(timeout)
+    return case, testing.returncode, output, time.time() - start, testing.usage
+
+
+def run_sharded(task, flavor, cases, workers, env=None, timeout=None, limits=None):
+    """Run cases across workers.
+
+    Returns merged report, exit code and (case, exit code, output, duration,
+    resource usage) of every case.
+    """
+    import concurrent.futures
+
+    durations = load_durations(task, flavor)
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_test_case, case, env, timeout, limits)
+                   for case in schedule(cases, durations)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            durations[result[0].key] = result[3]
+            results.append(result)
+    store_durations(task, flavor, durations)
+
+    results.sort(key=lambda result: result[0].key)
+    failed = [result for result in results if result[1] != 0]
+    report = []
+    for case, returncode, output, elapsed, _ in failed:
+        report.append('==== {} FAILED with exit code {} ====\n{}'.format(case.key, returncode, output))
+    for case, returncode, output, elapsed, _ in results:
+        report.append('{:<8}{:>8.2f}s  {}\n'.format('ok' if returncode == 0 else 'FAIL', elapsed, case.key))
+    report.append('{}: {} of {} test cases passed\n'.format(flavor, len(results) - len(failed), len(results)))
+    return ''.join(report), failed[0][1] if failed else 0, results
@@ -0,0 +1,74 @@
+import hashlib
+import subprocess
+
+from _init import *
+from _testcache import compiler_identity
+
+STYLE_CACHE_PATH = os.path.join(CONFIG_DIR, 'style-cache.json')
+
+SOURCE_EXTENSIONS = ('.h', '.hpp', '.ipp', '.c', '.cc', '.cpp')
+STYLE_FILE_NAMES = ('.clang-format', '_clang-format')
+
+
+def find_sources(directory):
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.') and name != 'build')
+        sources.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(SOURCE_EXTENSIONS))
+    return sources
+
+
+def find_style_file(task):
+    """Find .clang-format the way clang-format does for files of the course task."""
+    directory = os.path.join(TPCC_REPO, 'tasks', task)
+    while True:
+        for name in STYLE_FILE_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def style_fingerprint(clang_format, style_file):
+    """Formatted hashes stay valid while clang-format and its style are the same."""
+    style = None
+    if style_file is not None:
+        with open(style_file, 'rb') as style_source:
+            style = content_hash(style_source.read())
+    return '{}:{}'.format(compiler_identity(clang_format), style)
+
+
+def load_formatted_hashes(fingerprint):
+    try:
+        with open(STYLE_CACHE_PATH) as cached:
+            cache = json.load(cached)
+    except (OSError, ValueError):
+        return {}
+    return cache['files'] if cache.get('fingerprint') == fingerprint else {}
+
+
+def store_formatted_hashes(fingerprint, files):
+    write_atomic(STYLE_CACHE_PATH, json.dumps({'fingerprint': fingerprint, 'files': files}))
+
+
+def format_source(clang_format, path, assume_filename):
+    """Return the formatted contents of path, or None if clang-format failed.
+
+    The source is fed through stdin with the name of a file in the course
+    task, so that clang-format picks up the course style.
+    """
+    with open(path, 'rb') as source:
+        formatted = run([clang_format, '--assume-filename={}'.format(assume_filename)],
+                        stdin=source,
+                        stdout=subprocess.PIPE,
+                        stderr=DEFAULT_ERROR)
+    if formatted.returncode != 0:
+        return None
+    return formatted.stdout
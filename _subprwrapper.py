@@ -1,11 +1,193 @@
 import logging
+import os
+import resource
+import signal
 import subprocess
+import sys
+import threading
+import time
+
+from _timing import describe, record
 
 logger = logging.getLogger('tpcc.wrapper')
 logger.setLevel(logging.DEBUG)
 
+RLIMITS = {
+    'memory': resource.RLIMIT_AS,
+    'cpu': resource.RLIMIT_CPU,
+}
+
+
+def decode_status(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def usage_dict(wall, usage):
+    return {
+        'wall': round(wall, 4),
+        'user': round(usage.ru_utime, 4),
+        'sys': round(usage.ru_stime, 4),
+        'maxrss_kb': usage.ru_maxrss,
+        'voluntary_switches': usage.ru_nvcsw,
+        'involuntary_switches': usage.ru_nivcsw
+    }
+
+
+def wait_timed(process, phase, start):
+    """Reap process with wait4 to record its own resource usage."""
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = decode_status(status)
+    wall = time.time() - start
+    record(phase, wall, usage.ru_utime, usage.ru_stime, usage.ru_maxrss, process.returncode)
+    return usage_dict(wall, usage)
+
+
+def read_stream(stream, chunks):
+    chunks.append(stream.read())
+    stream.close()
+
+
+def kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+# commands running in their own session, they do not get Ctrl-C from the terminal
+_sessions = set()
+_sessions_lock = threading.Lock()
+
+
+def kill_sessions():
+    with _sessions_lock:
+        processes = list(_sessions)
+    for process in processes:
+        kill_group(process)
+
 
-def run(command: list, *args, **kwargs):
+def interrupt_handler(signum, frame):
+    """SIGINT handler killing commands started in their own session."""
+    kill_sessions()
+    raise KeyboardInterrupt
+
+
+def apply_limits(pid, limits):
+    for name, value in limits.items():
+        resource.prlimit(pid, RLIMITS[name], (value, value))
+
+
+class Supervisor:
+    """Kill the whole process group of a command on timeout or Ctrl-C.
+
+    Commands with a timeout or limits run in their own session, so that
+    every child they spawn can be killed at once.
+    """
+
+    def __init__(self, kwargs, timeout, limits):
+        self.timeout = timeout
+        self.timed_out = False
+        self.timer = None
+        self.process = None
+        self.limits = limits
+        self.session = timeout is not None or bool(limits)
+        if self.session:
+            kwargs['start_new_session'] = True
+
+    def start(self, process):
+        self.process = process
+        if self.limits:
+            # commands are started from worker threads, where a preexec_fn
+            # may deadlock the fork, so limits are set right after the spawn
+            try:
+                apply_limits(process.pid, self.limits)
+            except OSError as e:
+                logger.warning('Can not limit {}: {}'.format(' '.join(process.args), e))
+        if self.session:
+            with _sessions_lock:
+                _sessions.add(process)
+        if self.timeout is not None:
+            self.timer = threading.Timer(self.timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def expire(self):
+        self.timed_out = True
+        logger.warning('{} timed out after {}s'.format(' '.join(self.process.args), self.timeout))
+        kill_group(self.process)
+
+    def interrupt(self):
+        kill_group(self.process)
+        with _sessions_lock:
+            _sessions.discard(self.process)
+
+    def finish(self, completed, usage):
+        if self.timer is not None:
+            self.timer.cancel()
+        with _sessions_lock:
+            _sessions.discard(self.process)
+        completed.usage = usage
+        completed.timed_out = self.timed_out
+        return completed
+
+
+def run(command: list, *args, phase=None, timeout=None, limits=None, **kwargs):
     logger.info(" ".join(command))
     logger.debug("run({}, {}, {})".format(command, args, kwargs))
-    return subprocess.run(command, *args, **kwargs)
+    supervisor = Supervisor(kwargs, timeout, limits)
+    start = time.time()
+    process = subprocess.Popen(command, *args, **kwargs)
+    supervisor.start(process)
+    try:
+        # read both pipes at once, otherwise the command may block on a full one
+        stderr = []
+        reader = None
+        if process.stderr is not None:
+            reader = threading.Thread(target=read_stream, args=(process.stderr, stderr))
+            reader.start()
+        stdout = process.stdout.read() if process.stdout is not None else None
+        if process.stdout is not None:
+            process.stdout.close()
+        if reader is not None:
+            reader.join()
+    except KeyboardInterrupt:
+        supervisor.interrupt()
+        wait_timed(process, phase or describe(command), start)
+        raise
+    usage = wait_timed(process, phase or describe(command), start)
+    completed = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr[0] if stderr else None)
+    return supervisor.finish(completed, usage)
+
+
+def run_tee(command: list, *args, phase=None, on_line=None, timeout=None, limits=None, **kwargs):
+    """Run command, echoing its output to stdout while capturing it.
+
+    Returns CompletedProcess with the combined stdout and stderr
+    of the command in its stdout attribute. on_line is called
+    with every line of output as soon as it is printed.
+    """
+    logger.info(" ".join(command))
+    logger.debug("run_tee({}, {}, {})".format(command, args, kwargs))
+    kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    supervisor = Supervisor(kwargs, timeout, limits)
+    output = []
+    start = time.time()
+    process = subprocess.Popen(command, *args, **kwargs)
+    supervisor.start(process)
+    try:
+        for line in process.stdout:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            output.append(line)
+            if on_line is not None:
+                on_line(line)
+        process.stdout.close()
+    except KeyboardInterrupt:
+        supervisor.interrupt()
+        wait_timed(process, phase or describe(command), start)
+        raise
+    usage = wait_timed(process, phase or describe(command), start)
+    completed = subprocess.CompletedProcess(process.args, process.returncode, ''.join(output))
+    return supervisor.finish(completed, usage)
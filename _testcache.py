@@ -0,0 +1,67 @@
+import hashlib
+import shutil
+import time
+
+from _init import *
+
+TEST_CACHE_DIR = os.path.join(CONFIG_DIR, 'test-cache')
+
+# Build directories and editor leftovers do not affect test results
+IGNORED_NAMES = {'build', '.git', '.idea', '.vscode', '__pycache__'}
+
+
+def hash_tree(digest, root):
+    if not os.path.isdir(root):
+        return
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(name for name in dirs if name not in IGNORED_NAMES)
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            digest.update(os.path.relpath(path, root).encode())
+            digest.update(b'\0')
+            with open(path, 'rb') as source:
+                digest.update(hashlib.sha256(source.read()).digest())
+
+
+def compiler_identity(compiler):
+    compiler = os.path.realpath(compiler)
+    stat = os.stat(compiler)
+    return '{}:{}:{}'.format(compiler, stat.st_size, int(stat.st_mtime))
+
+
+def test_cache_key(task, flavor, compiler, mode='target'):
+    """Key of a test result; mode tells how tests were run, verdicts of different modes differ."""
+    digest = hashlib.sha256()
+    digest.update('{}\0{}\0{}\0{}\0'.format(task, flavor, mode, compiler_identity(compiler)).encode())
+    hash_tree(digest, os.path.join(SOLUTIONS_REPO, task))
+    digest.update(b'\0')
+    hash_tree(digest, os.path.join(TPCC_REPO, 'tasks', task))
+    return digest.hexdigest()
+
+
+def test_cache_path(task, key):
+    return os.path.join(TEST_CACHE_DIR, task, key + '.json')
+
+
+def load_test_result(task, key):
+    try:
+        with open(test_cache_path(task, key)) as cached:
+            return json.load(cached)
+    except (OSError, ValueError):
+        return None
+
+
+def store_test_result(task, key, flavor, returncode, output):
+    path = test_cache_path(task, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as cached:
+        json.dump({
+            'flavor': flavor,
+            'returncode': returncode,
+            'output': output,
+            'time': time.time()
+        }, cached)
+
+
+def clear_test_results(task):
+    shutil.rmtree(os.path.join(TEST_CACHE_DIR, task), ignore_errors=True)
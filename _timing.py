@@ -0,0 +1,115 @@
+import atexit
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_PATH = os.path.join(os.path.expanduser('~'), '.tpcc', 'trace.jsonl')
+# the trace is rotated once it grows over this size
+TRACE_LIMIT = 8 * 1024 * 1024
+
+_lock = threading.Lock()
+# imported by _init, so start time includes most of the startup
+_invocation = {'id': '{}-{}'.format(os.getpid(), int(time.time() * 1000)), 'command': None, 'start': time.time()}
+phases = []
+
+
+def describe(command):
+    """Short phase name of a command line: tool and its subcommand or targets."""
+    tool = os.path.basename(command[0])
+    if tool == 'git' and len(command) > 1:
+        return 'git ' + command[1]
+    if tool in ('make', 'ninja'):
+        targets = [arg for arg in command[1:] if not arg.startswith('-') and not arg.isdigit()]
+        return ' '.join([tool] + targets)
+    return tool
+
+
+def record(phase, wall, user, system, maxrss, returncode):
+    entry = {
+        'time': time.time(),
+        'invocation': _invocation['id'],
+        'command': _invocation['command'],
+        'phase': phase,
+        'wall': round(wall, 4),
+        'user': round(user, 4),
+        'sys': round(system, 4),
+        'maxrss_kb': maxrss,
+        'returncode': returncode
+    }
+    with _lock:
+        phases.append(entry)
+        try:
+            if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) > TRACE_LIMIT:
+                os.replace(TRACE_PATH, TRACE_PATH + '.1')
+            with open(TRACE_PATH, 'a') as trace:
+                trace.write(json.dumps(entry) + '\n')
+        except OSError:
+            pass
+
+
+@contextmanager
+def timed(phase):
+    """Record in-process work, e.g. GitLab API calls, as a phase."""
+    start_wall = time.time()
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    returncode = 0
+    try:
+        yield
+    except BaseException:
+        returncode = 1
+        raise
+    finally:
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        record(phase, time.time() - start_wall, end.ru_utime - start.ru_utime, end.ru_stime - start.ru_stime,
+               end.ru_maxrss, returncode)
+
+
+def start_invocation(command, print_timings=False):
+    _invocation['command'] = command
+    atexit.register(finish_invocation, print_timings)
+
+
+def finish_invocation(print_timings):
+    # commands that timed nothing, e.g. status run from a shell prompt, leave no trace
+    if not phases and not print_timings:
+        return
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    record('total', time.time() - _invocation['start'], own.ru_utime, own.ru_stime, own.ru_maxrss, None)
+    if print_timings:
+        print_breakdown()
+
+
+def print_breakdown():
+    total = phases[-1]['wall'] if phases and phases[-1]['phase'] == 'total' else None
+    print('\n{:<36}{:>9}{:>9}{:>9}{:>11}{:>6}'.format('phase', 'wall, s', 'user, s', 'sys, s', 'max RSS', 'exit'))
+    for entry in phases:
+        print('{:<36}{:>9.2f}{:>9.2f}{:>9.2f}{:>8} MB{:>6}'.format(
+            entry['phase'][:35], entry['wall'], entry['user'], entry['sys'], entry['maxrss_kb'] // 1024,
+            '' if entry['returncode'] is None else entry['returncode']))
+    if total:
+        accounted = sum(entry['wall'] for entry in phases[:-1])
+        print('{:<36}{:>9.2f}'.format('(not in subprocesses)', max(0.0, total - accounted)))
+
+
+def load_trace():
+    entries = []
+    for path in (TRACE_PATH + '.1', TRACE_PATH):
+        try:
+            with open(path) as trace:
+                for line in trace:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return entries
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
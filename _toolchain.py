@@ -0,0 +1,140 @@
+import re
+import subprocess
+import threading
+from shutil import which
+
+from _init import *
+
+TOOLCHAIN_PATH = os.path.join(CONFIG_DIR, 'toolchain.json')
+
+MIN_CLANG_VERSION = (5, 0)
+
+_toolchain = None
+# flavors run in threads and all of them need the toolchain
+_toolchain_lock = threading.Lock()
+
+
+def search_path_dirs():
+    return [directory for directory in os.environ.get('PATH', '').split(os.pathsep) if directory]
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def fingerprint(profile=None):
+    """Everything a probe result depends on.
+
+    Installing or removing a tool changes the mtime of its PATH directory,
+    upgrading a tool changes the mtime of the binary.
+    """
+    binaries = []
+    if profile is not None:
+        binaries = [profile[tool] for tool in ('compiler', 'linker', 'clang_format', 'ninja', 'ccache')
+                    if profile.get(tool)]
+    return {
+        'path': os.environ.get('PATH', ''),
+        'mtimes': {path: get_mtime(path) for path in search_path_dirs() + binaries}
+    }
+
+
+def find_versioned(name):
+    """Find all name and name-<version> executables in PATH."""
+    pattern = re.compile(r'^{}(-[0-9.]+)?$'.format(re.escape(name)))
+    found = {}
+    for directory in search_path_dirs():
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            continue
+        for entry in entries:
+            path = os.path.join(directory, entry)
+            if pattern.match(entry) and entry not in found and os.access(path, os.X_OK):
+                found[entry] = path
+    return list(found.values())
+
+
+def get_version(binary):
+    try:
+        output = subprocess.run([binary, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout
+    except OSError:
+        return None
+    match = re.search(r'version (\d+)\.(\d+)', output)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def find_newest(name, min_version=(0, 0)):
+    candidates = []
+    for binary in find_versioned(name):
+        version = get_version(binary)
+        if version is not None and version >= min_version:
+            candidates.append((version, binary))
+    if not candidates:
+        return None, None
+    version, binary = max(candidates)
+    return binary, '{}.{}'.format(*version)
+
+
+def find_sanitizers(compiler):
+    runtime_dirs = []
+    for flag in ('--print-runtime-dir', '-print-resource-dir'):
+        output = subprocess.run([compiler, flag], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip()
+        if output:
+            runtime_dirs.append(output if flag == '--print-runtime-dir' else os.path.join(output, 'lib', 'linux'))
+    sanitizers = []
+    for sanitizer in ('asan', 'tsan', 'ubsan'):
+        for directory in runtime_dirs:
+            if os.path.isdir(directory) and any(name.startswith('libclang_rt.{}'.format(sanitizer))
+                                                for name in os.listdir(directory)):
+                sanitizers.append(sanitizer)
+                break
+    return sanitizers
+
+
+def probe():
+    compiler, version = find_newest('clang++', MIN_CLANG_VERSION)
+    linker = None
+    if compiler is not None:
+        # prefer lld of the same version as the compiler
+        suffix = os.path.basename(compiler)[len('clang++'):]
+        linker = which('ld.lld' + suffix) or which('ld.lld')
+    clang_format, _ = find_newest('clang-format')
+    profile = {
+        'compiler': compiler,
+        'compiler_version': version,
+        'linker': linker,
+        'clang_format': clang_format,
+        'ninja': which('ninja'),
+        'ccache': which('ccache'),
+        'sanitizers': find_sanitizers(compiler) if compiler is not None else []
+    }
+    profile['fingerprint'] = fingerprint(profile)
+    return profile
+
+
+def get_toolchain(refresh=False):
+    """Return toolchain profile, probing tools only if something changed."""
+    global _toolchain
+    with _toolchain_lock:
+        if _toolchain is not None and not refresh:
+            return _toolchain
+
+        if not refresh:
+            try:
+                with open(TOOLCHAIN_PATH) as cached:
+                    profile = json.load(cached)
+                if profile.get('fingerprint') == fingerprint(profile):
+                    _toolchain = profile
+                    return _toolchain
+            except (OSError, ValueError):
+                pass
+
+        logger.info('Probing toolchain')
+        _toolchain = probe()
+        write_atomic(TOOLCHAIN_PATH, json.dumps(_toolchain, indent=4))
+        return _toolchain
@@ -0,0 +1,110 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Build directories are written by the build itself
+IGNORED_DIRS = {'build', '.git', '.idea', '.vscode', '__pycache__'}
+
+
+def is_ignored_file(name):
+    # editor swap and backup files
+    return name.startswith('.') or name.endswith('~') or name.endswith('.swp')
+
+
+def walk_dirs(roots):
+    for root in roots:
+        for directory, dirs, _ in os.walk(root):
+            dirs[:] = [name for name in dirs if name not in IGNORED_DIRS]
+            yield directory
+
+
+class InotifyWatcher:
+    """Watch directory trees for changes with Linux inotify."""
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for directory in walk_dirs(roots):
+            if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for {}'.format(directory))
+
+    def read_changes(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                changed = changed or not is_ignored_file(name)
+
+    def wait(self, timeout):
+        """Return True if something changed within timeout seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(readable) and self.read_changes()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for systems without inotify: compare mtimes periodically."""
+
+    def __init__(self, roots, interval=0.5):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        snapshot = {}
+        for directory in walk_dirs(self.roots):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if not is_ignored_file(name) and os.path.isfile(path):
+                    stat = os.stat(path)
+                    snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.take_snapshot()
+        changed = snapshot != self.snapshot
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(roots):
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher(roots)
+
+
+def wait_quiet(watcher, debounce):
+    """Wait until no changes happen for debounce seconds."""
+    while watcher.wait(debounce):
+        pass
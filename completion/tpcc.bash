@@ -0,0 +1,44 @@
+# bash completion for tpcc
+#
+#   source /path/to/tpcc/completion/tpcc.bash
+#
+# Task names are read from the index kept by tpcc in ~/.tpcc/task-names,
+# so completion does not start python.
+
+_tpcc_commands="task status config tasks build clean cache stats doctor daemon test stress watch bench style commit push merge sync pull update"
+
+_tpcc_task_names() {
+    local index="${HOME}/.tpcc/task-names" dirs="${HOME}/.tpcc/task-dirs" stale= dir
+    if [[ -f ${index} && -f ${dirs} ]]; then
+        # a task added or removed changes the mtime of tasks/ or its group
+        while read -r dir; do
+            [[ ${dir} -nt ${index} ]] && stale=1 && break
+        done < "${dirs}"
+    else
+        stale=1
+    fi
+    [[ -n ${stale} ]] && tpcc tasks --names > /dev/null 2>&1
+    [[ -f ${index} ]] && cat "${index}"
+}
+
+_tpcc() {
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+    local prev="${COMP_WORDS[COMP_CWORD-1]}"
+    local command i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case "${COMP_WORDS[i]}" in
+            -j|--jobs) ((i++)) ;;
+            -*) ;;
+            *) command="${COMP_WORDS[i]}"; break ;;
+        esac
+    done
+
+    if [[ -z ${command} ]]; then
+        COMPREPLY=($(compgen -W "${_tpcc_commands}" -- "${cur}"))
+    elif [[ ${command} == task && ${cur} != -* && ${prev} != -t && ${prev} != --template ]] ||
+         [[ ${prev} == --tasks ]]; then
+        COMPREPLY=($(compgen -W "$(_tpcc_task_names)" -- "${cur}"))
+    fi
+}
+
+complete -F _tpcc tpcc
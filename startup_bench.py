@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Measure tpcc startup time for lightweight subcommands.
+
+For every subcommand tpcc is started several times with -X importtime.
+The best wall time and the cumulative import time of the heaviest
+top-level modules are reported. Exit code is non-zero if any subcommand
+is slower than the budget, so the script can guard against regressions.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TPCC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tpcc.py')
+
+DEFAULT_COMMANDS = ['status', 'config', '--help']
+
+
+def measure(command, repeat):
+    best_wall = None
+    imports = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', TPCC] + command.split(),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        wall = time.perf_counter() - start
+        if best_wall is None or wall < best_wall:
+            best_wall = wall
+            imports = parse_importtime(result.stderr)
+    return best_wall, imports
+
+
+def parse_importtime(output):
+    """Return cumulative import time in microseconds of top-level imports."""
+    imports = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit() or name.startswith('  '):
+            continue
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tpcc startup benchmark')
+    parser.add_argument('commands', nargs='*', default=DEFAULT_COMMANDS,
+                        help='subcommands to measure (default: {})'.format(' '.join(DEFAULT_COMMANDS)))
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='number of runs per subcommand, the best one is reported')
+    parser.add_argument('--top', type=int, default=5,
+                        help='number of heaviest imports to show')
+    parser.add_argument('--budget', type=float, default=100.0,
+                        help='maximum allowed wall time in milliseconds')
+    args = parser.parse_args()
+
+    failed = False
+    for command in args.commands:
+        wall, imports = measure(command, args.repeat)
+        verdict = 'ok' if wall * 1000 <= args.budget else 'OVER BUDGET'
+        failed = failed or verdict != 'ok'
+        print('tpcc {:<12}{:>8.1f} ms  {}'.format(command, wall * 1000, verdict))
+        heaviest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for name, cumulative in heaviest:
+            print('\t{:<30}{:>8.1f} ms'.format(name, cumulative / 1000))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
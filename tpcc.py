@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
-from shutil import which
-import git
+import collections
+import contextlib
+import fnmatch
+import io
+import signal
+import subprocess
+import threading
+import time
 import shutil
-import re
-import gitlab
 
 from _init import *
+from _subprwrapper import run_tee, interrupt_handler
+from _sharding import find_test_binaries, list_test_cases, run_sharded
+from _toolchain import get_toolchain, TOOLCHAIN_PATH
+from _timing import timed, start_invocation, load_trace, percentile
+from _bench import median, median_confidence_interval, mann_whitney
+from _gitlabapi import resolve, get_project, get_project_id, invalidate
+from _testcache import test_cache_key, load_test_result, store_test_result, clear_test_results
+from _catalog import get_catalog, get_task_info, read_head
+from _style import find_sources, find_style_file, content_hash, style_fingerprint, load_formatted_hashes, \
+    store_formatted_hashes, format_source
+from _pushqueue import async_push_enabled, enqueue, retry_failed, load_queue, describe_entry
 from yes_no import query_yes_no
 
 def add_parser(subparsers, name, description, handlers, action) -> argparse.ArgumentParser:
@@ -17,15 +32,24 @@ def add_parser(subparsers, name, description, handlers, action) -> argparse.Argu
 
 
 def is_theoretical_task(task_name):
-    return not os.path.exists(os.path.join(TPCC_REPO, 'tasks', task_name, 'CMakeLists.txt'))
+    info = get_task_info(task_name)
+    if info is None:
+        return not os.path.exists(os.path.join(TPCC_REPO, 'tasks', task_name, 'CMakeLists.txt'))
+    return not info['practical']
 
 
+# GitPython and python-gitlab take hundreds of milliseconds to import,
+# so they are imported only by the actions that need them
+
 class SetTaskAction:
     def __init__(self):
+        import git
         self.git = git.Repo(SOLUTIONS_REPO).git
 
     def run(self, args):
         args.task_name = args.task_name.strip('/')
+        if worktree_mode():
+            self.init_worktrees()
         if self.branch_exists(args.task_name):
             self.checkout_branch_create(args.task_name)
             state['task'] = args.task_name
@@ -41,19 +65,66 @@ class SetTaskAction:
 
     # noinspection PyMethodMayBeStatic
     def is_task_name(self, task_name: str):
-        if task_name.count('/') != 1:
-            return False
-        return os.path.isdir(os.path.join(TPCC_REPO, 'tasks', task_name))
+        return get_task_info(task_name) is not None
 
     def branch_exists(self, branch_name):
+        import git
         try:
             self.git.rev_parse('--verify', branch_name)
             return True
         except git.exc.GitCommandError:
             return False
 
+    # noinspection PyMethodMayBeStatic
+    def init_worktrees(self):
+        if os.path.islink(SOLUTIONS_REPO):
+            return
+        status = run(['git', 'status', '--porcelain'],
+                     cwd=SOLUTIONS_REPO,
+                     stdout=subprocess.PIPE,
+                     stderr=DEFAULT_ERROR,
+                     universal_newlines=True)
+        if status.returncode != 0 or status.stdout.strip():
+            logger.error('Commit or stash changes in {} before enabling worktrees'.format(SOLUTIONS_REPO))
+            exit(1)
+        # a branch can be checked out in one worktree only, so keep tasks out of the main one
+        checkout = run(['git', 'checkout', 'master'],
+                       cwd=SOLUTIONS_REPO,
+                       stdout=DEFAULT_OUTPUT,
+                       stderr=DEFAULT_ERROR)
+        if checkout.returncode != 0:
+            logger.error('Checkout failed with exit code {}'.format(checkout.returncode))
+            exit(checkout.returncode)
+        logger.warning('Moving solutions repository to {} to enable worktrees'.format(MAIN_WORKTREE))
+        os.makedirs(WORKTREES_DIR, exist_ok=True)
+        os.rename(SOLUTIONS_REPO, MAIN_WORKTREE)
+        try:
+            activate_worktree(MAIN_WORKTREE)
+        except OSError:
+            if not os.path.lexists(SOLUTIONS_REPO):
+                os.rename(MAIN_WORKTREE, SOLUTIONS_REPO)
+            raise
+
+    def activate_task_worktree(self, task_name):
+        worktree = get_task_worktree(task_name)
+        if not os.path.exists(worktree):
+            if self.branch_exists(task_name):
+                command = ['git', 'worktree', 'add', worktree, task_name]
+            else:
+                command = ['git', 'worktree', 'add', '-b', task_name, worktree, 'master']
+            add = run(command,
+                      cwd=MAIN_WORKTREE,
+                      stdout=DEFAULT_OUTPUT,
+                      stderr=DEFAULT_ERROR)
+            if add.returncode != 0:
+                logger.error('Worktree creation failed with exit code {}'.format(add.returncode))
+                exit(add.returncode)
+        activate_worktree(worktree)
+
     def checkout_branch_create(self, task_name):
-        if self.branch_exists(task_name):
+        if worktree_mode():
+            self.activate_task_worktree(task_name)
+        elif self.branch_exists(task_name):
             checkout = run(['git', 'checkout', task_name],
                            cwd=SOLUTIONS_REPO,
                            stdout=DEFAULT_OUTPUT,
@@ -77,7 +148,7 @@ class SetTaskAction:
     # noinspection PyMethodMayBeStatic
     def create_solution_file(self, args):
         solution_dir = os.path.join(SOLUTIONS_REPO, args.task_name)
-        if not os.path.exists(os.path.join(TPCC_REPO, 'tasks', args.task_name, 'CMakeLists.txt')):
+        if is_theoretical_task(args.task_name):
             self.add_theoretical_solution(args, solution_dir)
         else:
             self.add_practical_solution(args, solution_dir)
@@ -130,10 +201,7 @@ or specify --no-template option to create empty file:
             cwd=SOLUTIONS_REPO,
             stdout=DEFAULT_OUTPUT,
             stderr=DEFAULT_ERROR)
-        run(['git', 'push', '--set-upstream', 'origin', task_name],
-            cwd=SOLUTIONS_REPO,
-            stdout=DEFAULT_OUTPUT,
-            stderr=DEFAULT_ERROR)
+        push_branch(task_name)
 
     @classmethod
     def add_parser(cls, subparsers, handlers):
@@ -156,6 +224,80 @@ or specify --no-template option to create empty file:
 
 def status_action(args=None):
     print(current_task())
+    queue = load_queue()
+    if queue:
+        print('Pushes in progress:')
+        for branch, entry in sorted(queue.items()):
+            print('\t' + describe_entry(branch, entry))
+
+
+def push_branch(branch):
+    """Push branch to origin or, with async_push enabled, queue the push and return at once."""
+    if async_push_enabled():
+        enqueue(branch)
+        print('Push of {} queued, see tpcc status'.format(branch))
+        return 0
+    push = run(['git', 'push', '--set-upstream', 'origin', branch],
+               cwd=SOLUTIONS_REPO,
+               stdout=DEFAULT_OUTPUT,
+               stderr=DEFAULT_ERROR)
+    return push.returncode
+
+
+class PushAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'push', 'Retry queued pushes and show their state', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('--wait',
+                               help='wait until all queued pushes are done',
+                               action='store_true')
+
+    # noinspection PyMethodMayBeStatic
+    def run(self, args):
+        retry_failed()
+        queue, reported = show_pushes(wait=args.wait)
+        if not reported:
+            print('Nothing to push')
+        if args.wait and queue:
+            exit(1)
+
+
+def show_pushes(branches=None, wait=True):
+    """Print state of queued pushes of branches (all by default), with wait until they are done.
+
+    Returns queue entries left unpushed and the branches reported.
+    """
+    reported = {}
+    while True:
+        queue = {branch: entry for branch, entry in load_queue().items() if branches is None or branch in branches}
+        for branch, entry in sorted(queue.items()):
+            line = describe_entry(branch, entry)
+            # retry countdowns change every poll, report only new attempts
+            if reported.get(branch) != (entry['attempts'], entry['failed']):
+                reported[branch] = (entry['attempts'], entry['failed'])
+                print(line)
+        if not wait or all(entry['failed'] for entry in queue.values()):
+            break
+        time.sleep(0.5)
+    for branch in sorted(set(reported) - set(queue)):
+        print('{}: pushed'.format(branch))
+    return queue, reported
+
+
+def wait_for_pushes(branches):
+    """Wait for queued pushes of branches, return those whose push failed.
+
+    Merge requests need the branch on origin, with async_push the push of
+    a fresh commit may still be in the queue.
+    """
+    queued = load_queue()
+    if not any(branch in queued for branch in branches):
+        return set()
+    print('Waiting for queued pushes')
+    failed, _ = show_pushes(branches)
+    return set(failed)
 
 
 def config_action(args=None):
@@ -164,64 +306,678 @@ def config_action(args=None):
 
 
 def get_clang_compiler():
-    clang_compiler = which('clang++-5.0')
-    if clang_compiler is None:
-        clang_compiler = which('clang++-6.0')
-    if clang_compiler is None:
-        clang_compiler = which('clang++')
+    clang_compiler = get_toolchain()['compiler']
     if clang_compiler is None:
         logger.error('Suitable clang compiler not found')
         exit(1)
     return clang_compiler
 
 
-def get_build_path():
-    if current_task() == '':
+def get_build_path(task=None):
+    if task is None:
+        task = current_task()
+    if task == '':
         print('No selected task. You should select task first:\n\ttpcc task <task_name>')
         logger.error('task not selected')
         exit(1)
 
-    return os.path.join(TPCC_REPO, 'tasks', current_task(), 'build')
+    return os.path.join(TPCC_REPO, 'tasks', task, 'build')
+
 
+def get_flavor_build_path(flavor, task=None):
+    return os.path.join(get_build_path(task), flavor)
 
-def run_cmake_target(targets):
-    build_path = get_build_path()
 
-    if not os.path.exists(os.path.join(build_path, 'Makefile')):
-        logger.warning('No Makefile found. Running build')
-        build_action()
+# Rough amount of memory a single clang++ job needs on course sources
+BUILD_JOB_MEMORY = 1024 * 1024 * 1024
 
-    return run(['make'] + targets, cwd=build_path)
+
+def get_available_memory():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_build_jobs():
+    if BUILD_JOBS is not None:
+        return BUILD_JOBS
+    jobs = os.cpu_count() or 1
+    memory = get_available_memory()
+    if memory is not None:
+        jobs = min(jobs, memory // BUILD_JOB_MEMORY)
+    return max(1, jobs)
+
+
+def get_build_generator(build_path):
+    # Generator of an already configured directory can not be changed,
+    # so stick to the one cmake was run with
+    if os.path.exists(os.path.join(build_path, 'build.ninja')):
+        return 'Ninja'
+    if os.path.exists(os.path.join(build_path, 'Makefile')):
+        return 'Unix Makefiles'
+    return None
+
+
+COMPILER_CACHE_DIR = os.path.join(CONFIG_DIR, 'ccache')
+
+
+def get_compiler_cache():
+    if not config.get('compiler_cache', True):
+        return None
+    return get_toolchain()['ccache']
+
+
+def get_build_env():
+    env = dict(os.environ)
+    env['CCACHE_DIR'] = COMPILER_CACHE_DIR
+    env['CCACHE_MAXSIZE'] = str(config.get('compiler_cache_size', '5G'))
+    # share cached objects between tasks and flavor build directories
+    env['CCACHE_BASEDIR'] = TPCC_REPO
+    env['CCACHE_NOHASHDIR'] = '1'
+    return env
+
+
+def run_cmake_target(targets, build_path=None, jobs=None, tee=False, task=None, on_line=None,
+                     timeout=None, limits=None, **kwargs):
+    if build_path is None:
+        build_path = get_build_path(task)
+    if jobs is None:
+        jobs = get_build_jobs()
+    kwargs.setdefault('env', get_build_env())
+
+    generator = get_build_generator(build_path)
+    if generator is None:
+        logger.warning('No build files found. Running build')
+        configure_build(build_path, task, **kwargs)
+        generator = get_build_generator(build_path)
+
+    tool = 'ninja' if generator == 'Ninja' else 'make'
+    prefix, limits = split_limits(limits)
+    command = prefix + [tool, '-j', str(jobs)] + targets
+    if tee:
+        return run_tee(command, cwd=build_path, on_line=on_line, timeout=timeout, limits=limits, **kwargs)
+    return run(command, cwd=build_path, timeout=timeout, limits=limits, **kwargs)
+
+
+def list_test_targets(build_path, keyword):
+    """Return build targets of test executables with keyword in their name."""
+    if get_build_generator(build_path) == 'Ninja':
+        listing = run(['ninja', '-t', 'targets', 'all'], cwd=build_path,
+                      stdout=subprocess.PIPE, stderr=DEFAULT_ERROR, universal_newlines=True)
+        outputs = [line.rpartition(': ') for line in listing.stdout.splitlines()]
+        return sorted(output for output, _, rule in outputs
+                      if rule.startswith('CXX_EXECUTABLE_LINKER') and keyword in os.path.basename(output))
+    # makefiles link every executable or library target with its link.txt
+    targets = []
+    for directory, dirs, files in os.walk(build_path):
+        if 'link.txt' in files and directory.endswith('.dir'):
+            name = os.path.basename(directory)[:-len('.dir')]
+            if keyword in name:
+                targets.append(name)
+    return sorted(targets)
+
+
+def configure_build(build_path, task=None, cmake_args=(), **kwargs):
+    if task is None:
+        task = current_task()
+    os.makedirs(build_path, exist_ok=True)
+    generator = get_build_generator(build_path)
+    if generator is None:
+        generator = 'Ninja' if get_toolchain()['ninja'] is not None else 'Unix Makefiles'
+    command = ['cmake', os.path.join(TPCC_REPO, 'tasks', task),
+               '-G', generator,
+               '-DCMAKE_CXX_COMPILER={}'.format(get_clang_compiler())] + list(cmake_args)
+    linker = get_toolchain()['linker']
+    if linker is not None:
+        # -fuse-ld=lld-10 makes clang run ld.lld-10
+        flavor = os.path.basename(linker)[len('ld.'):]
+        for kind in ('EXE', 'SHARED', 'MODULE'):
+            command.append('-DCMAKE_{}_LINKER_FLAGS=-fuse-ld={}'.format(kind, flavor))
+    compiler_cache = get_compiler_cache()
+    if compiler_cache is not None:
+        command.append('-DCMAKE_CXX_COMPILER_LAUNCHER={}'.format(compiler_cache))
+    kwargs.setdefault('env', get_build_env())
+    return run(command, cwd=build_path, **kwargs)
 
 
 def build_action(args=None):
-    run(['cmake', '..', '-DCMAKE_CXX_COMPILER={}'.format(get_clang_compiler())],
-        cwd=get_build_path())
+    configure_build(get_build_path())
+
+
+class DoctorAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'doctor', 'Show detected toolchain', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('--refresh',
+                               help='probe the toolchain again',
+                               action='store_true')
+
+    # noinspection PyMethodMayBeStatic
+    def run(self, args):
+        toolchain = get_toolchain(args.refresh)
+        print('compiler:     {} ({})'.format(toolchain['compiler'] or 'not found', toolchain['compiler_version']))
+        print('linker:       {}'.format(toolchain['linker'] or 'system default'))
+        print('clang-format: {}'.format(toolchain['clang_format'] or 'not found'))
+        print('ninja:        {}'.format(toolchain['ninja'] or 'not found, using make'))
+        print('ccache:       {}'.format(toolchain['ccache'] or 'not found'))
+        print('sanitizers:   {}'.format(', '.join(toolchain['sanitizers']) or 'not found'))
+        print('profile:      {}'.format(TOOLCHAIN_PATH))
+
+
+class CacheAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'cache', 'Manage compiler cache', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('command', help='Cache command',
+                               choices=['stats', 'clear'],
+                               nargs='?',
+                               default='stats')
+
+    def run(self, args):
+        compiler_cache = get_toolchain()['ccache']
+        if compiler_cache is None:
+            logger.error('ccache not found. Install ccache to enable compiler cache')
+            exit(1)
+        if args.command == 'clear':
+            run([compiler_cache, '--clear'], env=get_build_env(), stdout=DEFAULT_OUTPUT, stderr=DEFAULT_ERROR)
+        else:
+            self.print_stats(compiler_cache)
+
+    # noinspection PyMethodMayBeStatic
+    def print_stats(self, compiler_cache):
+        stats = run([compiler_cache, '--print-stats'], env=get_build_env(),
+                    stdout=subprocess.PIPE, stderr=DEFAULT_ERROR, universal_newlines=True)
+        if stats.returncode != 0:
+            # ccache older than 3.7 has no machine readable statistics
+            run([compiler_cache, '--show-stats'], env=get_build_env())
+            return
+
+        counters = {}
+        for line in stats.stdout.splitlines():
+            key, _, value = line.partition('\t')
+            if value.isdigit():
+                counters[key] = int(value)
+
+        hits = counters.get('direct_cache_hit', 0) + counters.get('preprocessed_cache_hit', 0)
+        misses = counters.get('cache_miss', 0)
+        total = hits + misses
+        print('cache directory: {}'.format(COMPILER_CACHE_DIR))
+        print('hits:            {}'.format(hits))
+        print('misses:          {}'.format(misses))
+        print('hit rate:        {:.1f}%'.format(100.0 * hits / total if total else 0.0))
+        print('size:            {:.1f} MiB / {}'.format(
+            counters.get('cache_size_kibibyte', 0) / 1024.0,
+            get_build_env()['CCACHE_MAXSIZE']))
+
+
+def list_task_branches():
+    branches = run(['git', 'for-each-ref', '--format=%(refname:short)', 'refs/heads'],
+                   cwd=SOLUTIONS_REPO,
+                   stdout=subprocess.PIPE,
+                   stderr=DEFAULT_ERROR,
+                   universal_newlines=True)
+    return [branch for branch in branches.stdout.split() if branch != 'master']
+
+
+def find_task_branches(pattern):
+    return [task for task in list_task_branches() if fnmatch.fnmatch(task, pattern)]
+
+
+def git_blob_hash(path):
+    """Return the object id git would give to the file contents."""
+    import hashlib
+    with open(path, 'rb') as source:
+        data = source.read()
+    return hashlib.sha1('blob {}\0'.format(len(data)).encode() + data).hexdigest()
+
+
+def extract_solution(task, ref):
+    """Replace solution of task with its version at ref, return False if there is none."""
+    import tarfile
+    solution_dir = os.path.join(SOLUTIONS_REPO, task)
+    archive = run(['git', 'archive', ref, task],
+                  cwd=SOLUTIONS_REPO,
+                  stdout=subprocess.PIPE,
+                  stderr=DEFAULT_ERROR)
+    if archive.returncode != 0:
+        return False
+    shutil.rmtree(solution_dir, ignore_errors=True)
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(SOLUTIONS_REPO)
+    # git archive stamps files with the commit time, which can be older than
+    # objects already built from other sources
+    for directory, _, files in os.walk(solution_dir):
+        for name in files:
+            os.utime(os.path.join(directory, name))
+    return True
+
+
+def read_files(directory):
+    contents = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as source:
+                contents[os.path.relpath(path, directory)] = source.read()
+    return contents
+
+
+def touch_differing(directory, replaced):
+    """Give the current mtime to files of directory whose contents are not the replaced ones."""
+    for name, data in read_files(directory).items():
+        if replaced.get(name) != data:
+            os.utime(os.path.join(directory, name))
+
+
+def backup_solution(task):
+    """Copy solution of task aside, keeping file mtimes."""
+    import tempfile
+    backup = tempfile.mkdtemp(dir=CONFIG_DIR, prefix='solution-backup-')
+    solution_dir = os.path.join(SOLUTIONS_REPO, task)
+    if os.path.exists(solution_dir):
+        shutil.copytree(solution_dir, os.path.join(backup, 'solution'), symlinks=True)
+    return backup
+
+
+def restore_solution(task, backup, touch_changed):
+    """Put back the solution saved by backup_solution.
+
+    With touch_changed, files that differ from the replaced ones get the
+    current mtime, so that a build made from the replaced files is redone.
+    """
+    solution_dir = os.path.join(SOLUTIONS_REPO, task)
+    replaced = read_files(solution_dir) if touch_changed else {}
+    shutil.rmtree(solution_dir, ignore_errors=True)
+    saved = os.path.join(backup, 'solution')
+    if os.path.exists(saved):
+        shutil.copytree(saved, solution_dir, symlinks=True)
+        if touch_changed:
+            touch_differing(solution_dir, replaced)
+    else:
+        try:
+            os.removedirs(os.path.dirname(solution_dir))
+        except OSError:
+            pass
+    shutil.rmtree(backup, ignore_errors=True)
+
+
+def export_task_solution(task):
+    """Put the committed solution of task in place of the checked out one.
+
+    Solutions of different tasks live in different directories, so they can
+    be built at the same time. The checked out files, committed or not, are
+    saved first. Returns the backup to pass to restore_task_solution, or
+    None if the task has no committed solution.
+    """
+    backup = backup_solution(task)
+    if not extract_solution(task, task):
+        shutil.rmtree(backup, ignore_errors=True)
+        return None
+    return backup
+
+
+def restore_task_solution(task, backup):
+    # the task build directory now holds objects of the committed solution
+    if worktree_mode():
+        # the solution was exported to the active worktree, the one
+        # of the task is what its build sees once the task is selected
+        worktree_solution = os.path.join(get_task_worktree(task), task)
+        if os.path.isdir(worktree_solution):
+            touch_differing(worktree_solution, read_files(os.path.join(SOLUTIONS_REPO, task)))
+    restore_solution(task, backup, touch_changed=True)
+
+
+BATCH_LOG_DIR = os.path.join(CONFIG_DIR, 'batch')
+
+
+DEFAULT_TEST_LIMITS = {'timeout': 1800}
+
+# Sanitizers reserve terabytes of address space, so RLIMIT_AS can not limit their memory
+SANITIZER_FLAVORS = {'asan', 'tsan'}
+
+
+def parse_size(size):
+    size = str(size).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def get_test_limits(flavor, timeout=None):
+    """Return timeout and resource limits of flavor runs.
+
+    Limits come from test_limits configuration key: "default" entry and
+    per-flavor entries with timeout (seconds), memory (bytes, or "4G")
+    and cpu (seconds of CPU time per process).
+    """
+    configured = config.get('test_limits', {})
+    limits = dict(DEFAULT_TEST_LIMITS)
+    limits.update(configured.get('default', {}))
+    limits.update(configured.get(flavor, {}))
+    if timeout is not None:
+        limits['timeout'] = timeout
+    timeout = limits.pop('timeout', None) or None
+
+    result = {}
+    if limits.get('cpu'):
+        result['cpu'] = int(limits['cpu'])
+    if limits.get('memory'):
+        memory = parse_size(limits['memory'])
+        if flavor in SANITIZER_FLAVORS:
+            result['cgroup_memory'] = memory
+        else:
+            result['memory'] = memory
+    return timeout, result
+
+
+def split_limits(limits):
+    """Split limits into command prefix for cgroup limits and rlimits."""
+    if not limits:
+        return [], None
+    limits = dict(limits)
+    memory = limits.pop('cgroup_memory', None)
+    if memory is None:
+        return [], limits
+    systemd_run = shutil.which('systemd-run')
+    if systemd_run is None:
+        logger.warning('systemd-run not found, memory limit of sanitizer tests is not enforced')
+        return [], limits
+    return [systemd_run, '--user', '--scope', '--quiet', '-p', 'MemoryMax={}'.format(memory)], limits
+
+
+def format_resources(resources):
+    return '{:.1f}s wall, {:.1f}s user, {:.1f}s sys, peak RSS {} MB, {} voluntary / {} involuntary context switches{}'.format(
+        resources['wall'], resources['user'], resources['sys'], resources['maxrss_kb'] // 1024,
+        resources['voluntary_switches'], resources['involuntary_switches'],
+        ', TIMED OUT' if resources.get('timed_out') else '')
+
+
+FLAVOR_TARGETS = collections.OrderedDict([
+    ('asan',   'run_asan_test'),
+    ('tsan',   'run_tsan_test'),
+    ('unit',   'run_all_unit_tests'),
+    ('stress', 'run_all_stress_tests'),
+])
 
 
 class TestAction:
+    report_dir = None
+    timeout = None
 
     @classmethod
     def run(cls, args):
-        cls.run_tests(args.flavor)
+        cls.report_dir = args.report_dir
+        cls.timeout = args.timeout
+        if args.tasks is not None or args.all_branches:
+            cls.run_tests_batch(args.tasks or '*', args.flavor, args.workers, args.cache)
+        elif args.shard:
+            cls.run_tests_sharded(list(FLAVOR_TARGETS) if args.flavor == 'all' else [args.flavor],
+                                  args.workers, args.cache and config.get('test_cache', True))
+        else:
+            cls.run_tests(args.flavor, args.parallel, args.workers, args.cache)
 
     @classmethod
-    def run_tests(self, flavor):
-        dispatcher = {
-            'asan':   'run_asan_test',
-            'tsan':   'run_tsan_test',
-            'unit':   'run_all_unit_tests',
-            'stress': 'run_all_stress_tests',
-            'all':   'run'
-        }
+    def run_tests(cls, flavor, parallel=None, workers=None, use_cache=True):
+        if parallel is None:
+            parallel = config.get('parallel_tests', False)
+        use_cache = use_cache and config.get('test_cache', True)
+
+        flavors = list(FLAVOR_TARGETS) if flavor == 'all' else [flavor]
+        if parallel:
+            cls.run_tests_parallel(flavors, workers, use_cache)
+            return
 
-        target = [dispatcher[flavor]]
+        for flavor in flavors:
+            returncode = cls.run_flavor_serial(flavor, use_cache)
+            if returncode != 0:
+                print('Testing failed with exit code {}'.format(returncode))
+                exit(returncode)
 
-        testing = run_cmake_target(target)
+    @classmethod
+    def lookup_cache(cls, task, flavor, use_cache, mode='target'):
+        if not use_cache:
+            return None, None
+        key = test_cache_key(task, flavor, get_clang_compiler(), mode)
+        return key, load_test_result(task, key)
 
-        if testing.returncode != 0:
-            print('Testing failed with exit code {}'.format(testing.returncode))
-            exit(testing.returncode)
+    @classmethod
+    def store_cache(cls, task, key, flavor, returncode, output):
+        # failures are never replayed: a failing run has to be reproduced anyway
+        if key is not None and returncode == 0:
+            store_test_result(task, key, flavor, returncode, output)
+
+    @classmethod
+    def resources(cls, testing):
+        resources = dict(testing.usage)
+        resources['timed_out'] = testing.timed_out
+        return resources
+
+    @classmethod
+    def report_results(cls, task, flavor, records, resources=None):
+        from _report import save_report
+        regressions = save_report(task, flavor, records, cls.report_dir, resources)
+        if resources is not None:
+            print('{} {}: {}'.format(task, flavor, format_resources(resources)))
+        for record, median in regressions:
+            print('{} {}: duration regression, {:.2f}s against median {:.2f}s of previous runs'.format(
+                task, record['name'], record['duration'], median))
+        failed = [record for record in records if record['status'] in ('failed', 'crashed')]
+        for record in failed:
+            for report in record['sanitizer']:
+                print('{} {}: {} {} at {}'.format(
+                    task, record['name'], report['tool'], report['type'], report['location']))
+
+    @classmethod
+    def run_flavor_serial(cls, flavor, use_cache):
+        from _report import TestOutputParser
+        key, cached = cls.lookup_cache(current_task(), flavor, use_cache)
+        if cached is not None:
+            print(cached['output'], end='')
+            print('[{} tests unchanged since last run, result taken from cache]'.format(flavor))
+            return cached['returncode']
+
+        parser = TestOutputParser(flavor)
+        timeout, limits = get_test_limits(flavor, cls.timeout)
+        testing = run_cmake_target([FLAVOR_TARGETS[flavor]], tee=True, on_line=parser.feed,
+                                   timeout=timeout, limits=limits)
+        cls.report_results(current_task(), flavor, parser.finish(testing.returncode, testing.usage['wall']),
+                           cls.resources(testing))
+        cls.store_cache(current_task(), key, flavor, testing.returncode, testing.stdout)
+        return testing.returncode
+
+    @classmethod
+    def run_flavor(cls, flavor, jobs=None, use_cache=True, task=None):
+        """Configure, build and run one flavor in its own build directory.
+
+        Output is captured, so that concurrently running flavors
+        do not interleave on the terminal.
+        """
+        from _report import TestOutputParser
+        if task is None:
+            task = current_task()
+        start = time.time()
+        key, cached = cls.lookup_cache(task, flavor, use_cache)
+        if cached is not None:
+            return flavor, cached['returncode'], cached['output'], time.time() - start
+
+        timeout, limits = get_test_limits(flavor, cls.timeout)
+        testing = run_cmake_target([FLAVOR_TARGETS[flavor]],
+                                   build_path=get_flavor_build_path(flavor, task),
+                                   jobs=jobs,
+                                   task=task,
+                                   timeout=timeout,
+                                   limits=limits,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        parser = TestOutputParser(flavor)
+        for line in testing.stdout.splitlines():
+            parser.feed(line)
+        cls.report_results(task, flavor, parser.finish(testing.returncode, testing.usage['wall']), cls.resources(testing))
+        cls.store_cache(task, key, flavor, testing.returncode, testing.stdout)
+        return flavor, testing.returncode, testing.stdout, time.time() - start
+
+    @classmethod
+    def run_tests_parallel(cls, flavors, workers=None, use_cache=True):
+        import concurrent.futures
+        if workers is None:
+            workers = min(len(flavors), os.cpu_count() or 1)
+        # share the build jobs between concurrently built flavors
+        jobs = max(1, get_build_jobs() // workers)
+
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(cls.run_flavor, flavor, jobs, use_cache) for flavor in flavors]
+            for future in concurrent.futures.as_completed(futures):
+                flavor, returncode, output, elapsed = future.result()
+                print('==== {} ({}) ===='.format(flavor, 'passed' if returncode == 0 else 'FAILED'))
+                print(output, end='')
+                results.append((flavor, returncode, elapsed))
+
+        print('\nSummary:')
+        results.sort(key=lambda result: flavors.index(result[0]))
+        for flavor, returncode, elapsed in results:
+            print('\t{:<8}{:<8}{:>8.1f}s'.format(flavor, 'passed' if returncode == 0 else 'FAILED', elapsed))
+
+        failed = [result for result in results if result[1] != 0]
+        if failed:
+            print('Testing failed for {}'.format(', '.join(result[0] for result in failed)))
+            exit(failed[0][1])
+
+    @classmethod
+    def run_tests_sharded(cls, flavors, workers=None, use_cache=True):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        for flavor in flavors:
+            if flavor == 'stress':
+                # stress tests are repeated by tpcc stress, not sharded
+                returncode = cls.run_flavor_serial(flavor, use_cache)
+            else:
+                returncode = cls.run_flavor_sharded(flavor, workers, use_cache)
+            if returncode != 0:
+                print('Testing failed with exit code {}'.format(returncode))
+                exit(returncode)
+
+    @classmethod
+    def run_flavor_sharded(cls, flavor, workers, use_cache):
+        from _report import TestOutputParser
+        task = current_task()
+        # sharded runs bypass the course run targets, never replay them as target runs
+        key, cached = cls.lookup_cache(task, flavor, use_cache, 'sharded')
+        if cached is not None:
+            print(cached['output'], end='')
+            print('[{} tests unchanged since last run, result taken from cache]'.format(flavor))
+            return cached['returncode']
+
+        build_path = get_flavor_build_path(flavor)
+        keyword = config.get('test_binaries', {}).get(flavor, flavor)
+        if get_build_generator(build_path) is None:
+            configure_build(build_path)
+        targets = list_test_targets(build_path, keyword)
+        if not targets:
+            logger.warning('No {} test binaries found, running {} without sharding'.format(flavor, flavor))
+            return cls.run_flavor_serial(flavor, use_cache)
+        # other flavors build their own binaries in their own directories
+        build = run_cmake_target(targets, build_path=build_path)
+        if build.returncode != 0:
+            return build.returncode
+
+        binaries = find_test_binaries(build_path, keyword)
+        cases = [case for binary in binaries for case in list_test_cases(binary)]
+        if not cases:
+            # nothing ran, do not report or cache it as a pass
+            logger.warning('No {} test cases found, running {} without sharding'.format(flavor, flavor))
+            return cls.run_flavor_serial(flavor, use_cache)
+        timeout, limits = get_test_limits(flavor, cls.timeout)
+        prefix, limits = split_limits(limits)
+        for case in cases:
+            case.command = prefix + case.command
+        report, returncode, results = run_sharded(task, flavor, cases, workers, get_build_env(), timeout, limits)
+        print(report, end='')
+        parser = TestOutputParser(flavor)
+        for case, case_returncode, output, elapsed, usage in results:
+            parser.add_record(case.key, case_returncode, elapsed, output, usage)
+        cls.report_results(task, flavor, parser.finish(returncode))
+        cls.store_cache(task, key, flavor, returncode, report)
+        return returncode
+
+    @classmethod
+    def run_tests_batch(cls, pattern, flavor, workers=None, use_cache=True):
+        """Build and test every task branch matching pattern concurrently."""
+        tasks = [task for task in find_task_branches(pattern) if not is_theoretical_task(task)]
+        if not tasks:
+            logger.error('No task branches match {}'.format(pattern))
+            exit(1)
+
+        results = cls.test_tasks(tasks, flavor, workers, use_cache)
+        if not results or any(returncode != 0 for returncode, _ in results.values()):
+            exit(1)
+
+    @classmethod
+    def test_tasks(cls, tasks, flavor, workers=None, use_cache=True):
+        """Test tasks concurrently, return {(task, flavor): (exit code, duration)}."""
+        import concurrent.futures
+        use_cache = use_cache and config.get('test_cache', True)
+
+        exported = {}
+        for task in tasks:
+            if task == current_task():
+                continue
+            backup = export_task_solution(task)
+            if backup is None:
+                logger.warning('Skipping {}: can not export its solution to {}'.format(
+                    task, os.path.join(SOLUTIONS_REPO, task)))
+                continue
+            exported[task] = backup
+        tasks = [task for task in tasks if task == current_task() or task in exported]
+        if not tasks:
+            return {}
+
+        flavors = list(FLAVOR_TARGETS) if flavor == 'all' else [flavor]
+        jobs = [(task, flavor) for task in tasks for flavor in flavors]
+        if workers is None:
+            workers = min(len(jobs), os.cpu_count() or 1)
+        build_jobs = max(1, get_build_jobs() // workers)
+
+        results = {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(cls.run_flavor, flavor, build_jobs, use_cache, task): task
+                           for task, flavor in jobs}
+                for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                    task = futures[future]
+                    flavor, returncode, output, elapsed = future.result()
+                    log_path = os.path.join(BATCH_LOG_DIR, task, flavor + '.log')
+                    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                    with open(log_path, 'w') as log:
+                        log.write(output)
+                    results[task, flavor] = (returncode, elapsed)
+                    print('[{}/{}] {} {} {} in {:.1f}s{}'.format(
+                        done, len(jobs), task, flavor,
+                        'passed' if returncode == 0 else 'FAILED', elapsed,
+                        '' if returncode == 0 else ', log: {}'.format(log_path)))
+        finally:
+            for task, backup in exported.items():
+                restore_task_solution(task, backup)
+
+        width = max(len(task) for task in tasks) + 2
+        print('\n' + 'task'.ljust(width) + ''.join('{:>16}'.format(flavor) for flavor in flavors))
+        for task in tasks:
+            print(task.ljust(width) + ''.join(
+                '{:>16}'.format('{} {:.1f}s'.format('ok' if results[task, flavor][0] == 0 else 'FAIL',
+                                                    results[task, flavor][1]))
+                for flavor in flavors))
+        return results
 
     @classmethod
     def add_parser(cls, subparsers, handlers):
@@ -229,16 +985,40 @@ class TestAction:
             subparsers, 'test', 'Test the solution', handlers, lambda x: cls().run(x)
         )
         subparser.add_argument('flavor', help='Which tests to run',
-                               choices=[
-                                   'asan',
-                                   'tsan',
-                                   'unit',
-                                   'stress',
-                                   'all'
-                               ],
+                               choices=list(FLAVOR_TARGETS) + ['all'],
                                nargs='?',
                                default='all',
                                const='all')
+        subparser.add_argument('-p', '--parallel',
+                               help='run each flavor in its own build directory concurrently',
+                               dest='parallel',
+                               action='store_true',
+                               default=None)
+        subparser.add_argument('-w', '--workers',
+                               help='maximum number of flavors (or task flavors with --tasks) to run at once',
+                               dest='workers',
+                               type=int)
+        subparser.add_argument('-s', '--shard',
+                               help='run test cases of unit and sanitizer tests as separate processes concurrently',
+                               dest='shard',
+                               action='store_true')
+        tasks = subparser.add_mutually_exclusive_group()
+        tasks.add_argument('--tasks',
+                           help='test every task branch matching the pattern, e.g. \'1-mutex/*\'',
+                           dest='tasks')
+        tasks.add_argument('--all-branches',
+                           help='test every task branch',
+                           dest='all_branches',
+                           action='store_true')
+        subparser.add_argument('--timeout', type=int,
+                               help='kill tests of a flavor running longer than TIMEOUT seconds')
+        subparser.add_argument('--report-dir',
+                               help='directory for JSON and JUnit reports (default: ~/.tpcc/reports/<task>)',
+                               dest='report_dir')
+        subparser.add_argument('--no-cache',
+                               help='run tests even if their result is cached',
+                               dest='cache',
+                               action='store_false')
 
 
 
@@ -263,12 +1043,388 @@ class TestAction:
 #     run_tests('all')
 #
 
-def style_action(args=None):
-    run_cmake_target(['style'])
+STRESS_LOG_DIR = os.path.join(CONFIG_DIR, 'stress')
+
+
+class StressAction:
+    """Run stress tests many times to catch rare failures.
+
+    Every run gets its own seed. The seed chooses the CPUs the run is pinned
+    to and is exported as TPCC_STRESS_SEED for tests that want it. Course
+    tests do not read it, so --seed repeats only the choice of CPUs, not
+    the interleaving that failed.
+    """
+
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'stress', 'Repeat stress tests to hunt flaky failures', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('-n', '--runs', type=int, default=100,
+                               help='number of runs')
+        subparser.add_argument('-p', '--parallel', type=int, default=os.cpu_count() or 1,
+                               help='number of runs executed at once')
+        subparser.add_argument('--affinity', type=int, metavar='CPUS',
+                               help='pin each run to CPUS randomly chosen cores')
+        subparser.add_argument('--load', type=int, default=0, metavar='PROCESSES',
+                               help='run PROCESSES busy loops in background to perturb scheduling')
+        subparser.add_argument('--seed', type=int,
+                               help='seed of the first run, following runs use consecutive seeds')
+        subparser.add_argument('--timeout', type=int,
+                               help='kill a run after TIMEOUT seconds and count it as failed')
+        subparser.add_argument('--keep-going', dest='stop_on_failure', action='store_false',
+                               help='do not stop on first failure')
+        subparser.add_argument('--binary', action='append', dest='binaries',
+                               help='stress test binary to run (default: every binary with "stress" in its name)')
+
+    def __init__(self):
+        self.stop = threading.Event()
+
+    def run(self, args):
+        import concurrent.futures
+        import random
+        build_path = get_flavor_build_path('stress')
+        build = run_cmake_target([], build_path=build_path)
+        if build.returncode != 0:
+            logger.error('Build failed with exit code {}'.format(build.returncode))
+            exit(build.returncode)
+
+        if args.binaries:
+            binaries = [os.path.join(build_path, binary) for binary in args.binaries]
+        else:
+            binaries = find_test_binaries(build_path, 'stress')
+        if not binaries:
+            logger.error('No stress test binaries found in {}'.format(build_path))
+            exit(1)
+
+        if args.affinity and shutil.which('taskset') is None:
+            logger.error('--affinity needs taskset')
+            exit(1)
+
+        first_seed = args.seed if args.seed is not None else random.randrange(2 ** 31)
+        load = [subprocess.Popen([sys.executable, '-c', 'while True: pass']) for _ in range(args.load)]
+        failures = []
+        completed = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.parallel) as executor:
+                futures = [executor.submit(self.run_once, binaries, first_seed + index, args)
+                           for index in range(args.runs)]
+                for future in concurrent.futures.as_completed(futures):
+                    result = future.result()
+                    if result is None:
+                        continue
+                    completed += 1
+                    seed, returncode, log_path = result
+                    if returncode != 0:
+                        failures.append(seed)
+                        print('Run with seed {} FAILED with exit code {}, log: {}'.format(seed, returncode, log_path))
+                        if args.stop_on_failure:
+                            self.stop.set()
+        finally:
+            for process in load:
+                process.kill()
+                process.wait()
+
+        print('{} of {} runs failed ({:.2f}%)'.format(
+            len(failures), completed, 100.0 * len(failures) / completed if completed else 0.0))
+        if failures:
+            print('Run on the same CPUs as the first failure with\n\ttpcc stress --runs 1 --seed {}{}'.format(
+                failures[0], ' --affinity {}'.format(args.affinity) if args.affinity else ''))
+            exit(1)
+
+    def run_once(self, binaries, seed, args):
+        import random
+        if self.stop.is_set():
+            return None
+
+        env = dict(os.environ, TPCC_STRESS_SEED=str(seed))
+        # runs are started from worker threads, where preexec_fn may deadlock
+        pin = []
+        if args.affinity:
+            cpus = sorted(os.sched_getaffinity(0))
+            cpus = sorted(random.Random(seed).sample(cpus, min(args.affinity, len(cpus))))
+            pin = ['taskset', '-c', ','.join(str(cpu) for cpu in cpus)]
+
+        output = []
+        returncode = 0
+        timeout, limits = get_test_limits('stress', args.timeout)
+        prefix, limits = split_limits(limits)
+        for binary in binaries:
+            testing = run(prefix + pin + [binary],
+                          cwd=os.path.dirname(binary),
+                          env=env,
+                          timeout=timeout,
+                          limits=limits,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+            output.append('==== {} ====\n{}{}'.format(
+                binary, testing.stdout, 'timed out after {}s\n'.format(timeout) if testing.timed_out else ''))
+            if testing.returncode != 0:
+                returncode = testing.returncode
+                break
+
+        if returncode == 0:
+            return seed, returncode, None
+        log_path = os.path.join(STRESS_LOG_DIR, current_task(), 'seed-{}.log'.format(seed))
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, 'w') as log:
+            log.write(''.join(output))
+        return seed, returncode, log_path
+
+
+class BenchAction:
+    """Measure solution performance in Release build.
+
+    With --against, the solution from another commit is built in its own
+    build directory and runs of both builds are interleaved, so that drift
+    of the machine load affects both equally.
+    """
+
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'bench', 'Benchmark the solution', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('-n', '--repetitions', type=int, default=10,
+                               help='number of measured runs')
+        subparser.add_argument('--warmup', type=int, default=2,
+                               help='number of runs before measuring')
+        subparser.add_argument('--cpus',
+                               help='comma separated list of CPUs to pin benchmarks to')
+        subparser.add_argument('--against', metavar='REF',
+                               help='compare with the solution at commit or branch REF of solutions repository')
+        subparser.add_argument('--binary', action='append', dest='binaries',
+                               help='binary to run (default: binaries with "bench" in name, or "stress" if none)')
+
+    def run(self, args):
+        task = current_task()
+        cpus = {int(cpu) for cpu in args.cpus.split(',')} if args.cpus else os.sched_getaffinity(0)
+
+        builds = [('current', self.build(get_flavor_build_path('bench'), args))]
+        if args.against:
+            with self.solution_at(task, args.against):
+                builds.append((args.against, self.build(get_flavor_build_path('bench-base'), args)))
+
+        times = {(name, binary): [] for name, binaries in builds for binary in binaries}
+        for iteration in range(args.warmup + args.repetitions):
+            for name, binaries in builds:
+                for binary in binaries:
+                    elapsed = self.run_binary(binaries[binary], cpus)
+                    if iteration >= args.warmup:
+                        times[name, binary].append(elapsed)
+
+        for binary in builds[0][1]:
+            print(binary)
+            for name, _ in builds:
+                values = times.get((name, binary))
+                if not values:
+                    continue
+                lower, upper = median_confidence_interval(values)
+                print('\t{:<20} median {:.4f}s, 95% CI [{:.4f}, {:.4f}], n={}'.format(
+                    name, median(values), lower, upper, len(values)))
+            if args.against and times.get((args.against, binary)):
+                current, base = times['current', binary], times[args.against, binary]
+                p_value = mann_whitney(current, base)
+                print('\t{:<20} {:+.1f}% (p={:.4f}, {})'.format(
+                    'change', 100.0 * (median(current) / median(base) - 1), p_value,
+                    'significant' if p_value < 0.05 else 'not significant'))
+
+    # noinspection PyMethodMayBeStatic
+    def build(self, build_path, args):
+        if get_build_generator(build_path) is None:
+            configure_build(build_path, cmake_args=['-DCMAKE_BUILD_TYPE=Release'])
+        build = run_cmake_target([], build_path=build_path)
+        if build.returncode != 0:
+            logger.error('Build failed with exit code {}'.format(build.returncode))
+            exit(build.returncode)
+
+        if args.binaries:
+            paths = [os.path.join(build_path, binary) for binary in args.binaries]
+        else:
+            paths = find_test_binaries(build_path, 'bench') or find_test_binaries(build_path, 'stress')
+        if not paths:
+            logger.error('No benchmark binaries found in {}'.format(build_path))
+            exit(1)
+        return collections.OrderedDict((os.path.relpath(path, build_path), path) for path in paths)
+
+    # noinspection PyMethodMayBeStatic
+    def run_binary(self, binary, cpus):
+        start = time.perf_counter()
+        bench = run([binary],
+                    cwd=os.path.dirname(binary),
+                    preexec_fn=lambda: os.sched_setaffinity(0, cpus),
+                    stdout=DEVNULL,
+                    stderr=DEVNULL)
+        elapsed = time.perf_counter() - start
+        if bench.returncode != 0:
+            logger.error('{} failed with exit code {}'.format(binary, bench.returncode))
+            exit(bench.returncode)
+        return elapsed
+
+    @contextlib.contextmanager
+    def solution_at(self, task, ref):
+        """Temporarily replace solution of task with its version at ref."""
+        backup = backup_solution(task)
+        try:
+            # extracted files get fresh mtimes, otherwise sources of an older
+            # ref look older than objects built from another ref
+            if not extract_solution(task, ref):
+                logger.error('Can not get solution of {} at {}'.format(task, ref))
+                exit(1)
+            yield
+        finally:
+            # the current solution is built in its own build directory, keep its mtimes
+            restore_solution(task, backup, touch_changed=False)
+
+
+class WatchAction:
+    """Rebuild and retest current task whenever its sources change.
+
+    Toolchain and build directory are set up once, every change only
+    runs the incremental build of the flavor target. A run that is still
+    going when a newer change arrives is killed and started over.
+    """
+
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'watch', 'Rebuild and test on every change of solution or tests', handlers,
+            lambda x: cls().run(x)
+        )
+        subparser.add_argument('flavor', help='Which tests to run',
+                               choices=list(FLAVOR_TARGETS) + ['all'],
+                               nargs='?',
+                               default='unit')
+        subparser.add_argument('--debounce', type=float, default=0.3,
+                               help='seconds without changes before a run starts')
+
+    def __init__(self):
+        self.process = None
+        self.started = None
+
+    def run(self, args):
+        from _watch import create_watcher, wait_quiet
+        task = current_task()
+        build_path = get_flavor_build_path(args.flavor)
+        if get_build_generator(build_path) is None:
+            configure_build(build_path)
+        generator = get_build_generator(build_path)
+        self.command = ['ninja' if generator == 'Ninja' else 'make', '-j', str(get_build_jobs()),
+                        FLAVOR_TARGETS.get(args.flavor, 'run')]
+        self.build_path = build_path
+        self.env = get_build_env()
+
+        watcher = create_watcher([os.path.join(SOLUTIONS_REPO, task), os.path.join(TPCC_REPO, 'tasks', task)])
+        print('Watching {} for changes, press Ctrl-C to stop'.format(task))
+        try:
+            self.start()
+            while True:
+                if watcher.wait(0.2):
+                    wait_quiet(watcher, args.debounce)
+                    self.start()
+                self.report()
+        except KeyboardInterrupt:
+            self.cancel()
+        finally:
+            watcher.close()
+
+    def start(self):
+        if self.cancel():
+            print('\n==== change detected, previous run cancelled ====')
+        else:
+            print('\n==== running {} ===='.format(' '.join(self.command[3:])))
+        self.started = time.time()
+        # own process group, so that the whole build can be killed at once
+        self.process = subprocess.Popen(self.command, cwd=self.build_path, env=self.env, start_new_session=True)
+
+    def cancel(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        os.killpg(self.process.pid, signal.SIGKILL)
+        self.process.wait()
+        self.process = None
+        return True
+
+    def report(self):
+        if self.process is None or self.process.poll() is None:
+            return
+        print('==== {} in {:.1f}s, waiting for changes ===='.format(
+            'passed' if self.process.returncode == 0 else 'FAILED', time.time() - self.started))
+        self.process = None
+
+
+class StyleAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'style', 'Run clang-format on solution files', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('--check',
+                               help='show what would change instead of formatting',
+                               action='store_true')
+
+    def run(self, args):
+        import concurrent.futures
+        import difflib
+
+        clang_format = get_toolchain()['clang_format']
+        if clang_format is None:
+            logger.error('clang-format not found')
+            exit(1)
+
+        task = current_task()
+        solution_dir = os.path.join(SOLUTIONS_REPO, task)
+        fingerprint = style_fingerprint(clang_format, find_style_file(task))
+        formatted_hashes = load_formatted_hashes(fingerprint)
+
+        sources = []
+        for path in find_sources(solution_dir):
+            with open(path, 'rb') as source:
+                data = source.read()
+            if formatted_hashes.get(path) != content_hash(data):
+                sources.append((path, data))
+
+        def format_one(source):
+            path, _ = source
+            assume_filename = os.path.join(TPCC_REPO, 'tasks', task, os.path.relpath(path, solution_dir))
+            return format_source(clang_format, path, assume_filename)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            results = list(executor.map(format_one, sources))
+
+        unformatted = []
+        for (path, data), formatted in zip(sources, results):
+            name = os.path.relpath(path, SOLUTIONS_REPO)
+            if formatted is None:
+                logger.error('clang-format failed on {}'.format(name))
+                unformatted.append(name)
+                continue
+            if formatted != data:
+                if args.check:
+                    sys.stdout.writelines(difflib.unified_diff(
+                        data.decode(errors='replace').splitlines(True),
+                        formatted.decode(errors='replace').splitlines(True),
+                        'a/' + name, 'b/' + name))
+                    unformatted.append(name)
+                    continue
+                with open(path, 'wb') as source:
+                    source.write(formatted)
+                print('Formatted {}'.format(name))
+            formatted_hashes[path] = content_hash(formatted)
+
+        store_formatted_hashes(fingerprint, {path: formatted_hash for path, formatted_hash in formatted_hashes.items()
+                                             if os.path.exists(path)})
+        if unformatted:
+            exit(1)
 
 
 def clean_action(args=None):
-    folder = get_build_path()
+    clean_build_dir()
+
+
+def clean_build_dir(task=None):
+    folder = get_build_path(task)
     for the_file in os.listdir(folder):
         if the_file == '.gitignore':
             continue
@@ -295,26 +1451,56 @@ class CommitTaskAction:
     def run(self, args):
         self.commit_task(args.message)
 
-    def solution_changed(self, task_name: str):
-        repo = git.Repo(SOLUTIONS_REPO)
-        run(['git', 'add', task_name],
-            cwd=SOLUTIONS_REPO,
-            stdout=DEFAULT_OUTPUT,
-            stderr=DEFAULT_ERROR)
-        diffs = repo.index.diff("HEAD")
-        for diff in diffs:
-            if re.match('{}/solution.(hpp|md)'.format(task_name), diff.b_path):
-                return True
-        return False
+    # noinspection PyMethodMayBeStatic
+    def task_changed(self, repo, task_name: str):
+        """Tell whether any file under the task directory differs from HEAD.
+
+        Only the HEAD subtree of the task is read, so the cost does not grow
+        with the number of tasks in the repository.
+        """
+        try:
+            head = {entry.path: entry.hexsha for entry in (repo.head.commit.tree / task_name).traverse()
+                    if entry.type == 'blob'}
+        except (ValueError, KeyError):
+            # no commits yet or task never committed
+            head = {}
+        working = {}
+        for directory, _, files in os.walk(os.path.join(SOLUTIONS_REPO, task_name)):
+            for name in files:
+                path = os.path.join(directory, name)
+                working[os.path.relpath(path, SOLUTIONS_REPO).replace(os.sep, '/')] = git_blob_hash(path)
+        untracked = [path for path in working if path not in head]
+        if untracked:
+            # git add skips ignored files, so they are no change either
+            for path in repo.ignored(*untracked):
+                del working[path]
+        return working != head
+
+    # noinspection PyMethodMayBeStatic
+    def stage_task(self, task_name: str):
+        """Stage every change under the task directory."""
+        add = run(['git', 'add', '--all', '--', task_name],
+                  cwd=SOLUTIONS_REPO,
+                  stdout=DEFAULT_OUTPUT,
+                  stderr=DEFAULT_ERROR)
+        if add.returncode != 0:
+            logger.error('Staging failed with exit code {}'.format(add.returncode))
+            exit(add.returncode)
 
     def solution_different_from_remote(self, task_name):
+        import git
         repo = git.Repo(SOLUTIONS_REPO)
 
 
     def commit_task(self, message):
+        import git
         task_name = current_task()
-        if self.solution_changed(task_name):
-            commit = run(['git', 'commit', task_name, '-m', message],
+        repo = git.Repo(SOLUTIONS_REPO)
+        if self.task_changed(repo, task_name):
+            self.stage_task(task_name)
+            # with a path, git commits HEAD with only the task directory replaced,
+            # other staged changes stay staged
+            commit = run(['git', 'commit', '-m', message, '--', task_name],
                          cwd=SOLUTIONS_REPO,
                          stdout=DEFAULT_OUTPUT,
                          stderr=DEFAULT_ERROR)
@@ -324,14 +1510,30 @@ class CommitTaskAction:
         else:
             logger.warning('Solution is up-to-date with local repository')
 
-        push = run(['git', 'push', '--set-upstream', 'origin', current_task()],
-                   cwd=SOLUTIONS_REPO,
-                   stdout=DEFAULT_OUTPUT,
-                   stderr=DEFAULT_ERROR)
+        returncode = push_branch(current_task())
+        if returncode != 0:
+            logger.error('Push failed with exit code {}'.format(returncode))
+            exit(returncode)
+
+
+def get_gitlab_settings():
+    try:
+        settings = {
+            'group_number': str(config['group_number']),
+            'first_name': config['first_name'],
+            'last_name': config['last_name'],
+            'gitlab_token': config['gitlab_token'],
+            'assignee_username': config['assignee_username'],
+            'gitlab_repo_user': config['gitlab_repo_user'],
+        }
+    except KeyError as e:
+        logger.error('Key "{}" is missing in configuration file'.format(e.args[0]))
+        exit(1)
 
-        if push.returncode != 0:
-            logger.error('Push failed with exit code {}'.format(push.returncode))
-            exit(push.returncode)
+    gitlab_repo_name = config.get('gitlab_repo_name', '{}-{}-{}'.format(
+        settings['group_number'], settings['first_name'], settings['last_name']))
+    settings['project_path'] = settings['gitlab_repo_user'] + '/' + gitlab_repo_name
+    return settings
 
 
 class GitlabMergeAction:
@@ -344,19 +1546,28 @@ class GitlabMergeAction:
                                help='do not run tests before creating merge request',
                                dest='test',
                                action='store_false')
+        subparser.add_argument('--no-cache',
+                               help='run tests before merge even if their result is cached',
+                               dest='cache',
+                               action='store_false')
+        subparser.add_argument('--tasks',
+                               help='create merge requests for every task branch matching the pattern',
+                               dest='tasks')
+        subparser.add_argument('-w', '--workers',
+                               help='maximum number of test runs at once with --tasks',
+                               dest='workers',
+                               type=int)
+        subparser.add_argument('-f', '--force',
+                               help='with --tasks, also resubmit already merged tasks',
+                               action='store_true')
 
     def run(self, args):
         try:
-            try:
-                group_number = str(config['group_number'])
-                first_name = config['first_name']
-                last_name = config['last_name']
-                gitlab_token = config['gitlab_token']
-                assignee_username = config['assignee_username']
-                gitlab_repo_user = config['gitlab_repo_user']
-            except KeyError as e:
-                logger.error('Key "{}" is missing in configuration file'.format(e.args[0]))
-                exit(1)
+            settings = get_gitlab_settings()
+            do_tests = self.do_tests(args)
+            if args.tasks is not None:
+                self.merge_tasks(args, settings, do_tests)
+                return
 
             merged_tasks = get_merged_tasks()
 
@@ -366,60 +1577,390 @@ class GitlabMergeAction:
                     print("Task not merged")
                     exit(1)
 
-            gitlab_repo_name = "{}-{}-{}".format(group_number, first_name, last_name)
+            project_id, assignee_id = resolve(settings['project_path'], settings['assignee_username'])
 
-            try:
-                gitlab_repo_name = config['gitlab_repo_name']
-            except KeyError:
-                pass
+            if do_tests and not is_theoretical_task(current_task()):
+                TestAction.run_tests('all', use_cache=args.cache)
+
+            if wait_for_pushes([current_task()]):
+                logger.error('Push of {} failed, merge request not created. Retry it with tpcc push'.format(
+                    current_task()))
+                exit(1)
+            self.create_merge_request(settings, project_id, assignee_id, current_task())
+        except SystemExit:
+            raise
+        except Exception as e:
+            print(e, file=sys.stderr)
+            traceback.print_exc()
+            exit(1)
+
+        merged_tasks.append(current_task())
+
+    # noinspection PyMethodMayBeStatic
+    def do_tests(self, args):
+        try:
+            do_tests = config['test_before_merge']
+        except KeyError:
+            print('Key test_before_merge not found in configuration file. Assuming true')
+            do_tests = True
+        return do_tests and args.test
+
+    def merge_tasks(self, args, settings, do_tests):
+        """Test all selected tasks at once, then submit merge requests of those that passed."""
+        merged_tasks = get_merged_tasks()
+        tasks = find_task_branches(args.tasks)
+        if not args.force:
+            for task in [task for task in tasks if task in merged_tasks]:
+                print('Skipping {}: already merged'.format(task))
+            tasks = [task for task in tasks if task not in merged_tasks]
+        if not tasks:
+            logger.error('No unmerged task branches match {}'.format(args.tasks))
+            exit(1)
 
-            gl = gitlab.Gitlab("https://gitlab.com", private_token=gitlab_token)
-            gl.auth()
+        project_id, assignee_id = resolve(settings['project_path'], settings['assignee_username'])
 
-            tpcc_project = gl.projects.get(gitlab_repo_user + '/' + gitlab_repo_name)
+        practical = [task for task in tasks if not is_theoretical_task(task)]
+        if do_tests and practical:
+            results = TestAction.test_tasks(practical, 'all', args.workers, args.cache)
+            failed = {task for (task, _), (returncode, _) in results.items() if returncode != 0}
+            # tasks that could not be tested are not submitted either
+            failed.update(task for task in practical if not any(key[0] == task for key in results))
+            for task in sorted(failed):
+                print('Skipping {}: tests failed'.format(task))
+            tasks = [task for task in tasks if task not in failed]
 
-            assignee = gl.users.list(username=assignee_username)[0]
+        failed = wait_for_pushes(tasks)
+        for task in sorted(failed):
+            print('Skipping {}: push failed, retry it with tpcc push'.format(task))
+        tasks = [task for task in tasks if task not in failed]
 
+        for task in tasks:
             try:
-                do_tests = config['test_before_merge']
-            except KeyError:
-                print('Key test_before_merge not found in configuration file. Assuming true')
-                do_tests = True
-
-            if do_tests and not is_theoretical_task(current_task()) and args.test:
-                TestAction.run_tests('all')
-
-            tpcc_project.mergerequests.create({
-                'source_branch': current_task(),
-                'target_branch': 'master',
-                'title': '[{}] [{}] {} {}'.format(
-                    group_number,
-                    current_task(),
-                    first_name,
-                    last_name
-                ),
-                'labels': [group_number, 'HW-{}'.format(current_task()[0])],
-                'assignee_id': assignee.id
-            })
+                self.create_merge_request(settings, project_id, assignee_id, task)
+            except Exception as e:
+                print('Merge request for {} not created: {}'.format(task, e), file=sys.stderr)
+                continue
+            print('Created merge request for {}'.format(task))
+            if task not in merged_tasks:
+                merged_tasks.append(task)
+
+    # noinspection PyMethodMayBeStatic
+    def create_merge_request(self, settings, project_id, assignee_id, task):
+        import gitlab
+        merge_request = {
+            'source_branch': task,
+            'target_branch': 'master',
+            'title': '[{}] [{}] {} {}'.format(
+                settings['group_number'],
+                task,
+                settings['first_name'],
+                settings['last_name']
+            ),
+            'labels': [settings['group_number'], 'HW-{}'.format(task[0])],
+            'assignee_id': assignee_id
+        }
+        try:
+            with timed('gitlab mergerequests.create'):
+                get_project(project_id).mergerequests.create(merge_request)
+        except gitlab.exceptions.GitlabCreateError as e:
+            if e.response_code != 404:
+                raise
+            # cached project is gone or was renamed
+            invalidate('project', settings['project_path'])
+            project_id = get_project_id(settings['project_path'])
+            with timed('gitlab mergerequests.create'):
+                get_project(project_id).mergerequests.create(merge_request)
+
+
+class SyncAction:
+    """Bring merged_tasks in line with merge requests on GitLab."""
+
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        add_parser(
+            subparsers, 'sync', 'Update merged tasks from GitLab merge requests', handlers, lambda x: cls().run(x)
+        )
+
+    # noinspection PyMethodMayBeStatic
+    def run(self, args):
+        settings = get_gitlab_settings()
+        try:
+            project_id = get_project_id(settings['project_path'])
+            with timed('gitlab mergerequests.list'):
+                merge_requests = get_project(project_id).mergerequests.list(state='all', per_page=100, all=True)
         except Exception as e:
             print(e, file=sys.stderr)
             traceback.print_exc()
             exit(1)
 
-        merged_tasks.append(current_task())
+        # the latest merge request of a branch decides its state
+        states = {}
+        for merge_request in sorted(merge_requests, key=lambda request: request.created_at):
+            states[merge_request.source_branch] = merge_request.state
+
+        merged_tasks = get_merged_tasks()
+        previous = set(merged_tasks)
+        merged_tasks[:] = sorted(task for task, state in states.items() if state in ('opened', 'merged'))
+        for task, state in sorted(states.items()):
+            change = ''
+            if task in merged_tasks and task not in previous:
+                change = ' (added)'
+            elif task in previous and task not in merged_tasks:
+                change = ' (removed)'
+            print('{:<40}{}{}'.format(task, state, change))
+        for task in sorted(previous - set(merged_tasks) - set(states)):
+            print('{:<40}{} (removed)'.format(task, 'no merge request'))
+
+
+class DaemonAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'daemon', 'Manage resident tpcc server', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('command', help='Daemon command',
+                               choices=['start', 'stop', 'restart', 'status'],
+                               nargs='?',
+                               default='status')
+
+    def run(self, args):
+        if args.command in ('stop', 'restart'):
+            self.stop()
+        if args.command in ('start', 'restart'):
+            self.start()
+        if args.command == 'status':
+            pid = self.control('ping')
+            print('tpcc daemon is running, pid {}'.format(pid) if pid else 'tpcc daemon is not running')
+
+    # noinspection PyMethodMayBeStatic
+    def control(self, command):
+        import socket
+        from _daemon import SOCKET_PATH, send_request
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(SOCKET_PATH)
+                send_request(sock, {'control': command}, [])
+                return json.loads(sock.makefile('r').readline())['pid']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def start(self):
+        if self.control('ping'):
+            print('tpcc daemon is already running')
+            return
+        subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), '_daemon.py')],
+                         stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+        for _ in range(50):
+            pid = self.control('ping')
+            if pid:
+                print('tpcc daemon started, pid {}'.format(pid))
+                return
+            time.sleep(0.1)
+        logger.error('tpcc daemon failed to start')
+        exit(1)
+
+    def stop(self):
+        pid = self.control('stop')
+        if pid:
+            print('tpcc daemon stopped')
+
+
+class StatsAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'stats', 'Show where time goes in tpcc commands', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('--phases',
+                               help='break every command down by phases',
+                               action='store_true')
+        subparser.add_argument('--command',
+                               help='show only this command')
 
+    # noinspection PyMethodMayBeStatic
+    def run(self, args):
+        groups = collections.OrderedDict()
+        for entry in load_trace():
+            if entry.get('command') is None or (args.command and entry['command'] != args.command):
+                continue
+            if entry['phase'] != 'total' and not args.phases:
+                continue
+            groups.setdefault((entry['command'], entry['phase']), []).append(entry['wall'])
+
+        if not groups:
+            print('No timings recorded yet')
+            return
 
+        print('{:<12}{:<32}{:>7}{:>9}{:>9}{:>9}{:>9}'.format('command', 'phase', 'runs', 'p50, s', 'p90, s',
+                                                            'p99, s', 'max, s'))
+        for (command, phase), walls in sorted(groups.items()):
+            print('{:<12}{:<32}{:>7}{:>9.2f}{:>9.2f}{:>9.2f}{:>9.2f}'.format(
+                command, phase[:31], len(walls), percentile(walls, 0.5), percentile(walls, 0.9),
+                percentile(walls, 0.99), max(walls)))
 
 
-def update_action(args=None):
-    run(['git', 'pull'], cwd=TPCC_REPO,
-        stdout=DEFAULT_OUTPUT,
-        stderr=DEFAULT_ERROR)
+class TasksAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        subparser = add_parser(
+            subparsers, 'tasks', 'List course tasks', handlers, lambda x: cls().run(x)
+        )
+        subparser.add_argument('--refresh',
+                               help='rescan course tasks even if nothing seems changed',
+                               action='store_true')
+        subparser.add_argument('--names',
+                               help='print task names only',
+                               action='store_true')
+
+    # noinspection PyMethodMayBeStatic
+    def run(self, args):
+        tasks = get_catalog(refresh=args.refresh)['tasks']
+        for task, info in sorted(tasks.items()):
+            if args.names:
+                print(task)
+                continue
+            print('{:<40}{:<13}{:<32}{}'.format(
+                task,
+                'practical' if info['practical'] else 'theoretical',
+                info['template'] or '-',
+                'branch' if info['branch'] else ''))
+
+
+# What a changed course file means for the builds that use it
+RECONFIGURE = 'reconfigure'
+REBUILD = 'rebuild'
+
+
+def classify_course_change(path):
+    """Return (task or group or None, action or None) for a changed course file."""
+    parts = path.split('/')
+    if path.endswith('.md') or parts[-1] == '.gitignore':
+        return None, None
+    action = RECONFIGURE if parts[-1] == 'CMakeLists.txt' or path.endswith('.cmake') or 'cmake' in parts[:-1] \
+        else REBUILD
+    if parts[0] == 'tasks' and len(parts) > 3:
+        return '/'.join(parts[1:3]), action
+    if parts[0] == 'tasks' and len(parts) == 3:
+        # files shared by a group of tasks
+        return parts[1], action
+    return None, action
+
+
+def has_build(task):
+    try:
+        return any(name != '.gitignore' for name in os.listdir(get_build_path(task)))
+    except OSError:
+        return False
+
+
+PREFETCH_MARKER = os.path.join(CONFIG_DIR, 'course-prefetched')
+
+
+class UpdateAction:
+    @classmethod
+    def add_parser(cls, subparsers, handlers):
+        for name in ('pull', 'update'):
+            subparser = add_parser(
+                subparsers, name, 'Pull from tpcc-course-2018 repository', handlers, lambda x: cls().run(x)
+            )
+            subparser.add_argument('--prefetch',
+                                   help='fetch in background and return, the next update only merges',
+                                   action='store_true')
+
+    def run(self, args):
+        if args.prefetch:
+            if os.path.exists(PREFETCH_MARKER):
+                os.unlink(PREFETCH_MARKER)
+            # the marker tells the next update that the fetch has completed
+            subprocess.Popen(['sh', '-c', 'git fetch --quiet && touch "$0"', PREFETCH_MARKER],
+                             cwd=TPCC_REPO,
+                             stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+            return
+
+        old_head = read_head(TPCC_REPO)
+        merged = False
+        if os.path.exists(PREFETCH_MARKER):
+            os.unlink(PREFETCH_MARKER)
+            merged = run(['git', 'merge', '--ff-only', '@{u}'], cwd=TPCC_REPO,
+                         stdout=DEFAULT_OUTPUT,
+                         stderr=DEFAULT_ERROR).returncode == 0
+        if not merged:
+            pull = run(['git', 'pull'], cwd=TPCC_REPO,
+                       stdout=DEFAULT_OUTPUT,
+                       stderr=DEFAULT_ERROR)
+            if pull.returncode != 0:
+                logger.error('Pull failed with exit code {}'.format(pull.returncode))
+                exit(pull.returncode)
+        new_head = read_head(TPCC_REPO)
+        # refresh the index read by shell completion
+        get_catalog()
+
+        if old_head is None or old_head == new_head:
+            print('Course is up to date')
+            return
+
+        diff = run(['git', 'diff', '--name-only', old_head, new_head],
+                   cwd=TPCC_REPO,
+                   stdout=subprocess.PIPE,
+                   stderr=DEFAULT_ERROR,
+                   universal_newlines=True)
+        self.invalidate(self.affected_tasks(diff.stdout.split()))
+
+    # noinspection PyMethodMayBeStatic
+    def affected_tasks(self, paths):
+        """Map every task to the strongest action its changed files require."""
+        tasks = get_catalog()['tasks']
+        affected = {}
+
+        def require(task, action, reason):
+            previous = affected.get(task)
+            if previous is None or (previous[0] == REBUILD and action == RECONFIGURE):
+                affected[task] = (action, reason)
+
+        for path in paths:
+            scope, action = classify_course_change(path)
+            if action is None:
+                continue
+            if scope in tasks:
+                require(scope, action, path)
+                continue
+            # shared files: every task of the group, or of the course
+            for task in tasks:
+                if scope is None or task.startswith(scope + '/'):
+                    require(task, action, path)
+        return affected
+
+    # noinspection PyMethodMayBeStatic
+    def invalidate(self, affected):
+        if not affected:
+            print('No task builds are affected')
+            return
+        unbuilt = 0
+        for task, (action, reason) in sorted(affected.items()):
+            clear_test_results(task)
+            if has_build(task):
+                if action == RECONFIGURE:
+                    clean_build_dir(task)
+                print('{:<40}{} ({}), cached test results dropped'.format(task, action, reason))
+            elif reason.startswith('tasks/{}/'.format(task)):
+                print('{:<40}changed ({}), not built yet'.format(task, reason))
+            else:
+                unbuilt += 1
+        if unbuilt:
+            print('{} more tasks are affected but not built yet'.format(unbuilt))
+
 
 def main():
     try:
         parser = argparse.ArgumentParser(prog='tpcc')
         parser.add_argument('-v', '--verbose', action='store_true', dest='verbose')
+        parser.add_argument('--timings', action='store_true', dest='timings',
+                            help='print time spent in every phase of the command')
+        parser.add_argument('-j', '--jobs', type=int, dest='jobs',
+                            help='number of parallel build jobs (default: based on cores and free memory)')
 
         subparsers = parser.add_subparsers(title='Actions', dest='action')
 
@@ -429,22 +1970,39 @@ def main():
         SetTaskAction.add_parser(subparsers, common_handlers)
         add_parser(subparsers, 'status', 'Print current task', common_handlers, status_action)
         add_parser(subparsers, 'config', 'Output current config', common_handlers, config_action)
+        TasksAction.add_parser(subparsers, common_handlers)
         add_parser(subparsers, 'build', 'Run cmake for current task', task_handlers, build_action)
         add_parser(subparsers, 'clean', 'Clean current task build directory', task_handlers, clean_action)
+        CacheAction.add_parser(subparsers, common_handlers)
+        StatsAction.add_parser(subparsers, common_handlers)
+        DoctorAction.add_parser(subparsers, common_handlers)
+        DaemonAction.add_parser(subparsers, common_handlers)
         TestAction.add_parser(subparsers, task_handlers)
-        add_parser(subparsers, 'style', 'Run clang-format on solution file', task_handlers, style_action)
+        StressAction.add_parser(subparsers, task_handlers)
+        WatchAction.add_parser(subparsers, task_handlers)
+        BenchAction.add_parser(subparsers, task_handlers)
+        StyleAction.add_parser(subparsers, task_handlers)
         CommitTaskAction.add_parser(subparsers, task_handlers)
+        PushAction.add_parser(subparsers, common_handlers)
         GitlabMergeAction.add_parser(subparsers, task_handlers)
-        add_parser(subparsers, 'pull', 'Pull from tpcc-course-2018 repository', common_handlers, update_action)
-        add_parser(subparsers, 'update', 'Pull from tpcc-course-2018 repository', common_handlers, update_action)
+        SyncAction.add_parser(subparsers, common_handlers)
+        UpdateAction.add_parser(subparsers, common_handlers)
 
         # process command line arguments
         args = parser.parse_args()
 
+        start_invocation(args.action, args.timings)
+        # tests run in their own sessions and have to be killed explicitly
+        signal.signal(signal.SIGINT, interrupt_handler)
+
         if args.verbose:
             global DEFAULT_ERROR
             DEFAULT_ERROR = None
 
+        if args.jobs is not None:
+            global BUILD_JOBS
+            BUILD_JOBS = max(1, args.jobs)
+
         if args.action in common_handlers:
             common_handlers[args.action](args)
         else:
@@ -469,7 +2027,7 @@ def main():
         exit_code = 1
     else:
         exit_code = 0
-    json.dump(state, open(STATE_PATH, 'w'))
+    save_state()
     raise SystemExit(exit_code)
 
 
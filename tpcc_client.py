@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Thin tpcc client.
+
+Forwards the command to the tpcc daemon if it is running, together with
+the terminal, so the output and prompts look exactly as in-process ones.
+Falls back to running tpcc in-process otherwise.
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+
+from _daemon import SOCKET_PATH, send_request
+
+# Commands that manage the daemon itself must not go through it
+LOCAL_COMMANDS = {'daemon'}
+
+
+def forward(argv):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        send_request(sock, {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}, [0, 1, 2])
+        replies = sock.makefile('r')
+        pid = None
+        while True:
+            try:
+                line = replies.readline()
+                if not line:
+                    return 1
+                reply = json.loads(line)
+                if 'pid' in reply:
+                    pid = reply['pid']
+                if 'exit' in reply:
+                    return reply['exit']
+            except KeyboardInterrupt:
+                # the command runs outside of the terminal process group
+                if pid is not None:
+                    os.kill(pid, signal.SIGINT)
+
+
+def main():
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in LOCAL_COMMANDS:
+        exit_code = forward(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    import tpcc
+    tpcc.main()
+
+
+if __name__ == '__main__':
+    main()